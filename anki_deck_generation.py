@@ -1,14 +1,28 @@
 import glob
+import json
 import os
+import re
 from pathlib import Path
-from typing import List, Tuple
+from typing import Dict, Iterable, List, Tuple
 import genanki
 import hashlib
 import uuid
 
+from anki_media import AnkiMedia
+from corpus_store import CorpusStore, parse_translated_verbs
+from metrics import metrics
+from pipeline_manifest import PipelineManifest
+
 
 class AnkiDeckGeneration:
-    def __init__(self, deck_name: str, text_content_path: str):
+    def __init__(
+        self,
+        deck_name: str,
+        text_content_path: str,
+        corpus_store: CorpusStore = None,
+        manifest: PipelineManifest = None,
+        anki_media: AnkiMedia = None,
+    ):
         self.anki_model = genanki.Model(
             1091735104,
             "Simple Model with Media",
@@ -52,8 +66,27 @@ class AnkiDeckGeneration:
             """,
         )
 
+        # Cards with the example sentence's audio need their own model id, as
+        # notes can't change their number of fields
+        self.anki_audio_model = genanki.Model(
+            1091735105,
+            "Simple Model with Audio",
+            fields=self.anki_model.fields + [{"name": "Audio", "font": "Arial"}],
+            templates=[
+                {
+                    "name": "Card 1",
+                    "qfmt": '{{Front}}<br><br><div class="example">{{Front-Context}}</div>',
+                    "afmt": '{{FrontSide}}\n\n<hr id=answer><b>{{Back-Definition}}</b><br><br><div class="example">{{Back-Context}}</div><br>{{Audio}}',
+                },
+            ],
+            css=self.anki_model.css,
+        )
+
         self.deck_name = deck_name
         self.text_content_path = text_content_path
+        self.corpus_store = corpus_store
+        self.manifest = manifest
+        self.anki_media = anki_media
 
     def get_uuid_from_string(self, string: str):
         m = hashlib.md5()
@@ -67,88 +100,202 @@ class AnkiDeckGeneration:
         m.update(string.encode("utf-8"))
         return int(m.hexdigest(), 16) % 2**32
 
-    def get_deck_content(
-        self,
-        original_text_glob_pattern: str = "./**/*].txt",
-        translation_suffix: str = "-translated",
-        nouns_suffix: str = "-nouns",
-        verbs_suffix: str = "-verbs",
-    ):
+    def get_translated_words(self, segments: Iterable[dict]) -> List[dict]:
         translated_words = []
         duplicate_words = set()
+        for segment in segments:
+            if not segment["translated_verbs"] or not segment["translation"]:
+                continue
+            for (
+                verb_es,
+                verb_en,
+                infinitive_es,
+                infinitive_en,
+            ) in parse_translated_verbs(segment["translated_verbs"]):
+                if infinitive_es in duplicate_words:
+                    continue
+                duplicate_words.add(infinitive_es)
+                translated_words.append(
+                    {
+                        "verb_es": verb_es,
+                        "verb_en": verb_en,
+                        "infinitive_es": infinitive_es,
+                        "infinitive_en": infinitive_en,
+                        "example_es": segment["transcript"].strip(),
+                        "example_en": segment["translation"].strip(),
+                        "video": segment["video"],
+                        "clip_name": segment["clip_name"],
+                    }
+                )
+        return translated_words
 
-        for original_sentences_path in glob.glob(
-            os.path.join(self.text_content_path, original_text_glob_pattern)
+    def read_segment_files(
+        self,
+        original_text_glob_pattern: str,
+        translation_suffix: str,
+        translated_verbs_suffix: str,
+    ) -> Iterable[dict]:
+        # Only this deck's video, in clip order like the corpus store, so the
+        # first example of each verb is the same in both modes
+        for original_sentences_path in sorted(
+            glob.glob(
+                os.path.join(
+                    self.text_content_path,
+                    glob.escape(self.deck_name),
+                    original_text_glob_pattern,
+                )
+            )
         ):
             path = Path(original_sentences_path)
+            translated_sentence_path = path.with_stem(path.stem + translation_suffix)
+            translated_verbs_path = path.with_stem(path.stem + translated_verbs_suffix)
+            # Clips skipped by the vocabulary step (empty transcripts, failed
+            # tagging) have no outputs
+            if not translated_sentence_path.exists() or not (
+                translated_verbs_path.exists()
+            ):
+                continue
+            yield {
+                "transcript": path.read_text(encoding="utf-8"),
+                "translation": translated_sentence_path.read_text(encoding="utf-8"),
+                "translated_verbs": translated_verbs_path.read_text(encoding="utf-8"),
+                "video": path.parent.name,
+                "clip_name": path.stem,
+            }
 
-            translated_sentence_path = path.with_stem(
-                path.stem + translation_suffix
-            ).as_posix()
-
-            example_en = open(
-                translated_sentence_path,
-                "r",
-                encoding="utf-8",
-            ).read()
-
-            example_es = open(
-                original_sentences_path,
-                "r",
-                encoding="utf-8",
-            ).read()
-
-            translated_verbs_path = path.with_stem(path.stem + verbs_suffix).as_posix()
-            with open(translated_verbs_path, "r", encoding="utf-8") as f:
-                while True:
-                    line = f.readline()
-                    if line == "-":
-                        break
-                    try:
-                        verb_es, verb_en = line.split(":")
-                        line = f.readline()
-                        infinitive_es, infinitive_en = line.split(":")
-                        line = f.readline()
-                        if infinitive_es not in duplicate_words:
-                            duplicate_words.add(infinitive_es)
-                            translated_words.append(
-                                {
-                                    "verb_es": verb_es.strip(),
-                                    "verb_en": verb_en.strip(),
-                                    "infinitive_es": infinitive_es.strip(),
-                                    "infinitive_en": infinitive_en.strip(),
-                                    "example_es": example_es.strip(),
-                                    "example_en": example_en.strip(),
-                                }
-                            )
-                        if line != "---":
-                            break
-                    except Exception as e:
-                        print(f"{translated_verbs_path}: Error in line: {line}")
-                        print(e)
-                        break
-        return translated_words
+    def get_deck_content(
+        self,
+        original_text_glob_pattern: str = "*].txt",
+        translation_suffix: str = "-translated",
+        translated_verbs_suffix: str = "-translated_verbs",
+    ):
+        if self.corpus_store:
+            segments = self.corpus_store.get_segments(self.deck_name)
+        else:
+            segments = self.read_segment_files(
+                original_text_glob_pattern,
+                translation_suffix,
+                translated_verbs_suffix,
+            )
+        return self.get_translated_words(segments)
+
+    def get_content_hash(self, deck_content: List[dict]) -> str:
+        # Covers only this deck's clips, plus the media settings that change
+        # the notes without changing the content
+        return self.manifest.get_hash_from_string(
+            json.dumps(deck_content, sort_keys=True, ensure_ascii=False),
+            json.dumps(
+                [
+                    bool(self.anki_media),
+                    self.anki_media and self.anki_media.media_format,
+                    self.anki_media and self.anki_media.bitrate,
+                ]
+            ),
+        )
+
+    def get_note(self, card_content: dict, media_file: str = None) -> genanki.Note:
+        fields = [
+            f"{card_content['verb_en']} ({card_content['infinitive_en']})",
+            card_content["example_en"],
+            f"{card_content['verb_es']} ({card_content['infinitive_es']})",
+            card_content["example_es"],
+        ]
+        if self.anki_media:
+            fields.append(
+                f"[sound:{os.path.basename(media_file)}]" if media_file else ""
+            )
+        return genanki.Note(
+            model=self.anki_audio_model if self.anki_media else self.anki_model,
+            fields=fields,
+            guid=self.get_uuid_from_string(card_content["infinitive_es"]),
+        )
 
-    def generate_deck(self, deck_content: List[Tuple[str, str, str, str, str, str]]):
+    def get_changed_notes(self, notes: List[genanki.Note]) -> List[genanki.Note]:
+        # Notes whose fields differ from the ones last written for this deck
+        if not self.manifest:
+            return notes
+        return [
+            note
+            for note in notes
+            if not self.manifest.is_done(
+                f"{self.deck_name}/{note.guid}",
+                "note",
+                self.manifest.get_hash_from_string(*note.fields),
+            )
+        ]
+
+    def write_package(
+        self,
+        notes: List[genanki.Note],
+        package_path: str,
+        media_files: Dict[str, str] = None,
+    ):
         deck_id = self.get_hash_from_string(self.deck_name)
         my_deck = genanki.Deck(deck_id, self.deck_name)
-        for card_content in deck_content:
-            my_note = genanki.Note(
-                model=self.anki_model,
-                fields=[
-                    f"{card_content['verb_en']} ({card_content['infinitive_en']})",
-                    card_content["example_en"],
-                    f"{card_content['verb_es']} ({card_content['infinitive_es']})",
-                    card_content["example_es"],
-                    # f"my_sound_file.mp3",
-                ],
-                guid=self.get_uuid_from_string(card_content["infinitive_es"]),
-            )
-            my_deck.add_note(my_note)
+        for note in notes:
+            my_deck.add_note(note)
 
         package = genanki.Package(my_deck)
+        if media_files:
+            # Only the media referenced by the packaged notes
+            package.media_files = [
+                media_files[note.guid] for note in notes if note.guid in media_files
+            ]
+        with metrics.timer("deck_write", deck=self.deck_name, notes=len(notes)):
+            package.write_to_file(package_path)
 
-        # my_package = genanki.Package(my_deck)
-        # my_package.media_files = ["my_sound_file.mp3", "images/my_image_file.jpg"]
+    def get_delta_package_path(self) -> str:
+        # Numbered, so a delta that hasn't been imported yet is never
+        # overwritten; import <deck>.apkg and then the deltas in order
+        sequences = [
+            int(match.group(1))
+            for delta_file in glob.glob(f"{glob.escape(self.deck_name)}.delta-*.apkg")
+            if (match := re.search(r"\.delta-(\d+)\.apkg$", delta_file))
+        ]
+        return f"{self.deck_name}.delta-{max(sequences, default=0) + 1:04d}.apkg"
+
+    def generate_deck(
+        self,
+        deck_content: List[Tuple[str, str, str, str, str, str]],
+        delta: bool = False,
+    ) -> int:
+        package_path = f"{self.deck_name}.apkg"
+        media_files = [None] * len(deck_content)
+        if self.anki_media:
+            with metrics.timer("deck_media", deck=self.deck_name):
+                media_files = self.anki_media.get_media_files(
+                    [
+                        (card_content.get("video"), card_content.get("clip_name"))
+                        for card_content in deck_content
+                    ]
+                )
+        notes = [
+            self.get_note(card_content, media_file)
+            for card_content, media_file in zip(deck_content, media_files)
+        ]
+        note_media_files = {
+            note.guid: media_file
+            for note, media_file in zip(notes, media_files)
+            if media_file
+        }
+        changed_notes = self.get_changed_notes(notes)
+        if not changed_notes and os.path.exists(package_path):
+            return 0
+
+        if delta and os.path.exists(package_path):
+            # Anki updates notes by GUID on import, so the delta package only
+            # needs the notes that are new or changed since the last build
+            self.write_package(
+                changed_notes, self.get_delta_package_path(), note_media_files
+            )
+        else:
+            self.write_package(notes, package_path, note_media_files)
 
-        package.write_to_file(f"{self.deck_name}.apkg")
+        if self.manifest:
+            for note in changed_notes:
+                self.manifest.mark_done(
+                    f"{self.deck_name}/{note.guid}",
+                    "note",
+                    self.manifest.get_hash_from_string(*note.fields),
+                )
+        return len(changed_notes)
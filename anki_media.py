@@ -0,0 +1,156 @@
+import hashlib
+import os
+import subprocess
+import threading
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from corpus_store import CLIP_NAME_PATTERN
+from video_transcription import AUDIO_FORMATS, SAMPLE_RATE, decode_audio
+
+MEDIA_FORMATS = {
+    # extension, ffmpeg codec
+    "opus": ("ogg", "libopus"),
+    "mp3": ("mp3", "libmp3lame"),
+}
+
+
+class AnkiMedia:
+    def __init__(
+        self,
+        audio_path: str = "output_audios",
+        media_path: str = "cache/anki_media",
+        media_format: str = "opus",
+        bitrate: str = "24k",
+        workers: int = 4,
+    ):
+        self.audio_path = audio_path
+        self.media_path = media_path
+        self.media_format = media_format
+        self.bitrate = bitrate
+        self.workers = max(workers, 1)
+        self.lock = threading.Lock()
+        self.decoded_file = None
+        self.decoded_samples = None
+
+        if not os.path.exists(media_path):
+            os.makedirs(media_path)
+
+    def get_audio_file(self, video: str) -> Optional[str]:
+        for extension, _, _ in AUDIO_FORMATS.values():
+            audio_file = os.path.join(self.audio_path, f"{video}.{extension}")
+            if os.path.exists(audio_file):
+                return audio_file
+        return None
+
+    def get_clip_range(self, clip_name: str) -> Optional[Tuple[float, float]]:
+        match = CLIP_NAME_PATTERN.match(clip_name)
+        if not match:
+            return None
+        _, _, start, duration = match.groups()
+        # Start and duration are whole seconds rounded down, so take the extra
+        # second to cover the end of the turn
+        return float(start), float(start) + float(duration) + 1.0
+
+    def get_decoded_samples(self, audio_file: str) -> np.ndarray:
+        # Clips are requested file by file, so only the last file is kept
+        with self.lock:
+            if self.decoded_file != audio_file:
+                self.decoded_samples = decode_audio(audio_file)
+                self.decoded_file = audio_file
+            return self.decoded_samples
+
+    def read_clip(self, audio_file: str, start: float, end: float) -> bytes:
+        # Only the clip's samples are read, never the whole episode, unless
+        # the file isn't 16 kHz mono 16-bit and has to be decoded
+        start_sample = int(start * SAMPLE_RATE)
+        end_sample = int(end * SAMPLE_RATE)
+        if audio_file.endswith(".wav"):
+            with wave.open(audio_file, "rb") as wav_file:
+                if (
+                    wav_file.getnchannels() == 1
+                    and wav_file.getframerate() == SAMPLE_RATE
+                    and wav_file.getsampwidth() == 2
+                ):
+                    start_sample = min(start_sample, wav_file.getnframes())
+                    wav_file.setpos(start_sample)
+                    return wav_file.readframes(end_sample - start_sample)
+            samples = self.get_decoded_samples(audio_file)
+        else:
+            samples = np.memmap(audio_file, dtype=np.float32, mode="r")
+        return (
+            (np.clip(samples[start_sample:end_sample], -1.0, 1.0) * 32767)
+            .astype(np.int16)
+            .tobytes()
+        )
+
+    def get_media_name(self, pcm: bytes) -> str:
+        m = hashlib.sha256()
+        m.update(pcm)
+        m.update(f"{self.media_format}:{self.bitrate}".encode("utf-8"))
+        return f"{m.hexdigest()[:32]}.{MEDIA_FORMATS[self.media_format][0]}"
+
+    def encode_clip(self, pcm: bytes, media_file: str):
+        from moviepy.config import FFMPEG_BINARY
+
+        temp_file = f"{media_file}.tmp"
+        subprocess.run(
+            [
+                FFMPEG_BINARY,
+                "-nostdin",
+                "-loglevel",
+                "error",
+                "-y",
+                "-f",
+                "s16le",
+                "-ar",
+                str(SAMPLE_RATE),
+                "-ac",
+                "1",
+                "-i",
+                "pipe:0",
+                "-acodec",
+                MEDIA_FORMATS[self.media_format][1],
+                "-b:a",
+                self.bitrate,
+                "-f",
+                "ogg" if self.media_format == "opus" else "mp3",
+                temp_file,
+            ],
+            input=pcm,
+            check=True,
+        )
+        os.replace(temp_file, media_file)
+
+    def __encode_media(self, media: Tuple[str, str, float, float]):
+        media_file, audio_file, start, end = media
+        self.encode_clip(self.read_clip(audio_file, start, end), media_file)
+
+    def get_media_files(self, clips: List[Tuple[str, str]]) -> List[Optional[str]]:
+        # Clips are (video, clip_name), the result holds the encoded file of
+        # each clip or None when its audio isn't available. Identical clips are
+        # encoded once, and clips encoded by an earlier build are reused.
+        media_files = []
+        pending: Dict[str, Tuple[str, str, float, float]] = {}
+        for video, clip_name in clips:
+            audio_file = video and self.get_audio_file(video)
+            clip_range = clip_name and self.get_clip_range(clip_name)
+            if not audio_file or not clip_range:
+                media_files.append(None)
+                continue
+            pcm = self.read_clip(audio_file, *clip_range)
+            if not pcm:
+                media_files.append(None)
+                continue
+            media_file = os.path.join(self.media_path, self.get_media_name(pcm))
+            media_files.append(media_file)
+            if not os.path.exists(media_file):
+                pending[media_file] = (media_file, audio_file, *clip_range)
+
+        # ffmpeg does the encoding in its own processes, threads only wait on it
+        with ThreadPoolExecutor(self.workers) as executor:
+            list(executor.map(self.__encode_media, pending.values()))
+        return media_files
@@ -1,84 +1,398 @@
 import os
+import time
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional, Tuple
 import click
 import glob
+import numpy as np
 from dynaconf import Dynaconf
 from anki_deck_generation import AnkiDeckGeneration
+from anki_media import AnkiMedia
+from corpus_store import CorpusStore
 from generate_conversation import GenerateConversation
+from lemma_index import LemmaIndex
+from metrics import JsonLinesSink, PrometheusSink, metrics
+from llm_cache import LLMCache
+from llm_client import LLMClient
+from model_daemon import ModelDaemon
+from model_registry import model_registry
+from parallel_ingest import ParallelIngest
+from pipeline_manifest import PipelineManifest
+from speech_cache import SpeechCache
+from transcription_backends import get_default_device, resolve_backend
 from video_transcription import VideoTranscription
 from vocabulary_extraction import VocabularyExtraction
+from vocabulary_pipeline import VocabularyPipeline
 from vocabulary_translation import VocabularyTranslation
 
 settings = Dynaconf(settings_files=["config.toml", ".secrets.toml"])
 
 
-def get_vocabulary_from_video(name):
-    video_transcription = VideoTranscription(
-        settings.pyannote.auth_key,
+def get_llm_cache() -> LLMCache:
+    if not settings.llm_cache.get("enabled", True):
+        return None
+    return LLMCache(
+        os.path.join(settings.config.cache_path, "llm_cache.sqlite"),
+        settings.llm_cache.get("max_entries", 200000),
+        settings.llm_cache.get("max_age_days", 90),
+    )
+
+
+def get_llm_client(llm_cache: LLMCache = None) -> LLMClient:
+    return LLMClient(
+        settings.openai_server.url,
+        settings.openai_server.api_key,
+        llm_cache,
+        settings.openai_server.get("timeout", 800),
+        [
+            {
+                "url": settings.openai_server.url,
+                "api_key": settings.openai_server.api_key,
+            },
+            *settings.openai_server.get("endpoints", []),
+        ],
+        settings.openai_server.get("max_in_flight", 8),
+        settings.openai_server.get("max_retries", 3),
+    )
+
+
+def get_video_transcription_options() -> dict:
+    device = settings.config.get("device", "auto")
+    if device == "auto":
+        device = get_default_device()
+    whisper_backend = resolve_backend(settings.whisper.get("backend", "auto"), device)
+    return {
+        "pyannote_token": settings.pyannote.auth_key,
+        "output_audio_path": settings.config.output_audio_path,
+        "output_text_path": settings.config.output_text_path,
+        "temp_path": settings.config.temp_path,
+        "whisper_model": settings.whisper.models[whisper_backend],
+        "device": device,
+        "write_segments": settings.config.get("write_segments", False),
+        "audio_format": settings.config.get("audio_format", "wav"),
+        "whisper_backend": whisper_backend,
+        "threads": settings.config.get("threads", 0),
+        "compute_type": settings.whisper.get("compute_type", "int8"),
+        "diarization_window": settings.pyannote.get("window", 0),
+        "diarization_overlap": settings.pyannote.get("overlap", 30),
+        "merge_gap": settings.segmentation.get("merge_gap", 0),
+        "min_duration": settings.segmentation.get("min_duration", 0),
+        "max_duration": settings.segmentation.get("max_duration", 0),
+        "energy_threshold": settings.segmentation.get("energy_threshold", 0),
+        "min_speech_ratio": settings.segmentation.get("min_speech_ratio", 0.2),
+        "result_cache_path": (
+            os.path.join(settings.config.cache_path, "transcription")
+            if settings.config.get("result_cache", True)
+            else None
+        ),
+    }
+
+
+def get_completed_transcripts(
+    video_transcription: VideoTranscription,
+    audio_file: str,
+    manifest: PipelineManifest = None,
+) -> Optional[List[Tuple[str, str]]]:
+    if not manifest:
+        return None
+    audio_hash = video_transcription.get_input_hash(audio_file)
+    if not manifest.is_done(audio_file, "transcribe", audio_hash):
+        return None
+    transcripts = []
+    for item in manifest.get_items(
+        f"{Path(audio_file).stem}/", "transcribe", audio_hash
+    ):
+        clip_path, clip_name = item.split("/", 1)
+        sentence_text = video_transcription.read_transcript(clip_path, clip_name)
+        if sentence_text is None:
+            return None
+        transcripts.append(
+            (
+                sentence_text,
+                os.path.join(settings.config.output_text_path, f"{item}.txt"),
+            )
+        )
+    return transcripts
+
+
+def split_audio_files(
+    video_transcription: VideoTranscription, audio_files: Iterable[str]
+) -> Iterable[Tuple[str, Optional[Tuple[np.ndarray, str, str]]]]:
+    for audio_file in audio_files:
+        for segment in video_transcription.split_sentences(audio_file):
+            yield audio_file, segment
+        yield audio_file, None
+
+
+def transcribe_audio_segments(
+    video_transcription: VideoTranscription,
+    audio_segments: Iterable[Tuple[str, Optional[Tuple[np.ndarray, str, str]]]],
+    batch_size: int = 1,
+    manifest: PipelineManifest = None,
+    on_file_done: Callable[[str], None] = None,
+) -> Iterable[Tuple[str, str]]:
+    audio_hashes = {}
+    segment_counts = {}
+    start_time = time.perf_counter()
+    batch = []
+
+    def get_audio_hash(audio_file: str) -> str:
+        if audio_file not in audio_hashes:
+            audio_hashes[audio_file] = video_transcription.get_input_hash(audio_file)
+        return audio_hashes[audio_file]
+
+    def mark_done(audio_file: str, clip_path: str, clip_name: str):
+        if manifest:
+            manifest.mark_done(
+                f"{clip_path}/{clip_name}", "transcribe", get_audio_hash(audio_file)
+            )
+
+    def transcribe_batch():
+        transcripts = video_transcription.transcribe_segments(
+            [segment for _, segment in batch]
+        )
+        for (audio_file, (_, clip_path, clip_name)), _ in zip(batch, transcripts):
+            mark_done(audio_file, clip_path, clip_name)
+        return transcripts
+
+    for audio_file, segment in audio_segments:
+        if segment is None:
+            # Finish the file's segments before recording it as complete
+            if batch:
+                yield from transcribe_batch()
+                batch = []
+            if manifest:
+                manifest.mark_done(audio_file, "diarize", get_audio_hash(audio_file))
+                manifest.mark_done(audio_file, "transcribe", get_audio_hash(audio_file))
+            if on_file_done:
+                on_file_done(audio_file)
+            elapsed = time.perf_counter() - start_time
+            segment_count = segment_counts.get(audio_file, 0)
+            print(
+                f"Transcribed {segment_count} segments of {audio_file} in "
+                f"{elapsed:.1f}s ({segment_count / elapsed if elapsed else 0:.2f} "
+                "segments/sec)"
+            )
+            start_time = time.perf_counter()
+            continue
+
+        segment_counts[audio_file] = segment_counts.get(audio_file, 0) + 1
+        _, clip_path, clip_name = segment
+        sentence_output_path = os.path.join(
+            settings.config.output_text_path, clip_path, f"{clip_name}.txt"
+        )
+        if manifest and manifest.is_done(
+            f"{clip_path}/{clip_name}", "transcribe", get_audio_hash(audio_file)
+        ):
+            sentence_text = video_transcription.read_transcript(clip_path, clip_name)
+            if sentence_text is not None:
+                yield sentence_text, sentence_output_path
+                continue
+        if batch_size <= 1:
+            transcript = video_transcription.transcribe_sentence(*segment)
+            mark_done(audio_file, clip_path, clip_name)
+            yield transcript
+            continue
+        batch.append((audio_file, segment))
+        if len(batch) >= batch_size:
+            yield from transcribe_batch()
+            batch = []
+
+
+def transcribe_audio_files(
+    video_transcription: VideoTranscription,
+    video_files: Iterable[str],
+    audio_files: Iterable[str],
+    batch_size: int = 1,
+    manifest: PipelineManifest = None,
+    workers: int = 1,
+) -> Iterable[Tuple[str, str]]:
+    video_jobs = {}
+    for video_file in video_files:
+        video_hash = video_transcription.get_file_hash(video_file)
+        if manifest and manifest.is_done(video_file, "extract", video_hash):
+            continue
+        video_jobs[video_transcription.get_audio_path(video_file)] = (
+            video_file,
+            video_hash,
+        )
+    audio_files = list(dict.fromkeys(list(audio_files) + list(video_jobs)))
+
+    pending_audio_files = []
+    for audio_file in audio_files:
+        transcripts = (
+            None
+            if audio_file in video_jobs
+            else get_completed_transcripts(video_transcription, audio_file, manifest)
+        )
+        if transcripts is None:
+            pending_audio_files.append(audio_file)
+            continue
+        print(f"Skipping diarization and transcription of {audio_file}")
+        yield from transcripts
+
+    def mark_extracted(audio_file: str):
+        if manifest and audio_file in video_jobs:
+            manifest.mark_done(
+                video_jobs[audio_file][0], "extract", video_jobs[audio_file][1]
+            )
+
+    if workers > 1:
+        parallel_ingest = ParallelIngest(
+            workers,
+            get_video_transcription_options(),
+            settings.config.get("ingest_queue_size", 64),
+        )
+        audio_segments = parallel_ingest.split_files(
+            [
+                (audio_file, *video_jobs.get(audio_file, (None, None)))
+                for audio_file in pending_audio_files
+            ]
+        )
+    else:
+        for audio_file in pending_audio_files:
+            if audio_file in video_jobs:
+                video_file, video_hash = video_jobs[audio_file]
+                video_transcription.extract_audio(video_file, video_hash=video_hash)
+                mark_extracted(audio_file)
+        audio_segments = split_audio_files(video_transcription, pending_audio_files)
+
+    yield from transcribe_audio_segments(
+        video_transcription, audio_segments, batch_size, manifest, mark_extracted
+    )
+
+
+def get_corpus_store() -> CorpusStore:
+    if not settings.config.get("corpus_store", False):
+        return None
+    return CorpusStore(os.path.join(settings.config.output_text_path, "corpus.sqlite"))
+
+
+def get_lemma_index() -> LemmaIndex:
+    if not settings.config.get("lemma_index", True):
+        return None
+    return LemmaIndex(os.path.join(settings.config.output_text_path, "lemmas.sqlite"))
+
+
+def get_anki_media() -> AnkiMedia:
+    if not settings.anki.get("media", False):
+        return None
+    return AnkiMedia(
         settings.config.output_audio_path,
-        settings.config.output_text_path,
-        settings.config.temp_path,
-        settings.whisper.model,
-        "mps",
+        os.path.join(settings.config.cache_path, "anki_media"),
+        settings.anki.get("media_format", "opus"),
+        settings.anki.get("media_bitrate", "24k"),
+        settings.anki.get("media_workers", 4),
     )
+
+
+def generate_decks(manifest: PipelineManifest = None, corpus_store: CorpusStore = None):
+    if corpus_store:
+        directories = corpus_store.get_videos()
+    else:
+        directories = [
+            directory
+            for directory in os.listdir(settings.config.output_text_path)
+            if os.path.isdir(os.path.join(settings.config.output_text_path, directory))
+        ]
+    anki_media = get_anki_media()
+    for directory in directories:
+        anki_deck_generation = AnkiDeckGeneration(
+            directory,
+            settings.config.output_text_path,
+            corpus_store,
+            manifest,
+            anki_media,
+        )
+        content = anki_deck_generation.get_deck_content()
+        if manifest:
+            content_hash = anki_deck_generation.get_content_hash(content)
+            if manifest.is_done(directory, "deck", content_hash) and os.path.exists(
+                f"{directory}.apkg"
+            ):
+                continue
+        changed_notes = anki_deck_generation.generate_deck(
+            content, settings.anki.get("package", "full") == "delta"
+        )
+        print(f"{directory}: {changed_notes} new or changed notes")
+        if manifest:
+            manifest.mark_done(directory, "deck", content_hash)
+
+
+def get_vocabulary_from_video(workers: int = 1):
+    corpus_store = get_corpus_store()
+    video_transcription = VideoTranscription(
+        **get_video_transcription_options(), corpus_store=corpus_store
+    )
+    llm_cache = get_llm_cache()
+    lemma_index = get_lemma_index()
+    llm_client = get_llm_client(llm_cache)
     vocabulary_extraction = VocabularyExtraction(
         settings.openai_server.url,
         settings.openai_server.api_key,
         settings.config.output_text_path,
         settings.openai_server.model,
+        llm_cache=llm_cache,
+        batch_token_budget=settings.openai_server.get("batch_token_budget", 1500),
+        corpus_store=corpus_store,
+        llm_client=llm_client,
     )
     vocabulary_translation = VocabularyTranslation(
         settings.openai_server.url,
         settings.openai_server.api_key,
         settings.config.output_text_path,
         settings.openai_server.model,
+        llm_cache=llm_cache,
+        batch_token_budget=settings.openai_server.get("batch_token_budget", 1500),
+        corpus_store=corpus_store,
+        lemma_index=lemma_index,
+        llm_client=llm_client,
     )
-    for video_file in glob.glob("input_videos/*.*"):
-        video_transcription.extract_audio(video_file)
-    for audio_file in glob.glob(f"{settings.config.output_audio_path}/*.wav"):
-        for sentence_audio, clip_path, clip_name in video_transcription.split_sentences(
-            audio_file
-        ):
-            sentence_text, sentence_output_path = (
-                video_transcription.transcribe_sentence(
-                    sentence_audio, clip_path, clip_name
-                )
-            )
+    manifest = PipelineManifest(
+        os.path.join(settings.config.output_text_path, "manifest.sqlite")
+    )
+    audio_files = glob.glob(f"{settings.config.output_audio_path}/*.wav") + glob.glob(
+        f"{settings.config.output_audio_path}/*.f32"
+    )
+    vocabulary_pipeline = VocabularyPipeline(
+        vocabulary_extraction,
+        vocabulary_translation,
+        settings.openai_server.get("concurrency", 8),
+        settings.openai_server.get("batch_size", 1),
+        settings.openai_server.get("extraction_mode", "chain") == "structured",
+        manifest,
+        corpus_store,
+    )
+    vocabulary_pipeline.run(
+        transcribe_audio_files(
+            video_transcription,
+            glob.glob(os.path.join(settings.config.input_video_path, "*.*")),
+            audio_files,
+            settings.whisper.get("batch_size", 1),
+            manifest,
+            workers,
+        )
+    )
+    if llm_cache:
+        print(f"LLM cache: {llm_cache.get_stats()}")
+        llm_cache.close()
+    if lemma_index:
+        print(f"Lemma index: {lemma_index.get_stats()}")
+        lemma_index.close()
 
-            sentence_output_path = sentence_output_path or os.path.join(
-                settings.config.output_text_path, clip_path, f"{clip_name}.txt"
-            )
+    generate_decks(manifest, corpus_store)
+    manifest.close()
+    if corpus_store:
+        corpus_store.close()
 
-            for vocab_pos in vocabulary_extraction.tag_part_of_speech(sentence_text):
-                if vocab_pos:
-                    verbs = vocabulary_extraction.get_verbs(
-                        sentence_text,
-                        vocab_pos,
-                        sentence_output_path.replace(".txt", "-verbs.txt"),
-                    )
-                    nouns = vocabulary_extraction.get_nouns(
-                        sentence_text,
-                        vocab_pos,
-                        sentence_output_path.replace(".txt", "-nouns.txt"),
-                    )
-
-                    translated_sentence = vocabulary_translation.translate_sentence(
-                        sentence_text,
-                        sentence_output_path.replace(".txt", "-translated.txt"),
-                    )
-                    translated_verbs = vocabulary_translation.translate_verbs(
-                        sentence_text,
-                        verbs,
-                        sentence_output_path.replace(".txt", "-translated_verbs.txt"),
-                    )
-                    print(f"Translated sentence: {translated_sentence}")
-                    print(f"Translated verbs: {translated_verbs}")
-
-    for directory in os.listdir(settings.config.output_text_path):
-        anki_deck_generation = AnkiDeckGeneration(
-            directory, settings.config.output_text_path
-        )
-        content = anki_deck_generation.get_deck_content()
-        anki_deck_generation.generate_deck(content)
+
+def import_corpus():
+    corpus_store = CorpusStore(
+        os.path.join(settings.config.output_text_path, "corpus.sqlite")
+    )
+    imported = corpus_store.import_directory(settings.config.output_text_path)
+    corpus_store.close()
+    print(f"Imported {imported} segments into the corpus store")
 
 
 def generate_conversation():
@@ -88,17 +402,102 @@ def generate_conversation():
         prompt="""You are a spanish shop assistent and you are helping a customer to find a product in the store. 
         The customer is asking you for a product that you don't have in the store. How do you respond to the customer? Keep your responses short and simple.
         (speak only in Argentine Spanish)""",
+        stream=settings.conversation.get("stream", True),
+        llm_client=get_llm_client(),
+        speech_cache=get_speech_cache(),
+        prewarm_phrases=settings.speech.get("prewarm", ["Hola"]),
     )
     conversation.generate()
 
 
-@click.command()
-@click.argument("command", type=click.Choice(["conversation", "anki_deck"]))
-def app(command: str):
+def get_speech_cache() -> SpeechCache:
+    if not settings.speech.get("cache_memory_mb", 32):
+        return None
+    return SpeechCache(
+        (
+            os.path.join(settings.config.cache_path, "speech")
+            if settings.speech.get("disk_cache", True)
+            else None
+        ),
+        settings.speech.get("cache_memory_mb", 32),
+        settings.speech.get("cache_max_characters", 100),
+    )
+
+
+def add_metrics_sinks():
+    if settings.metrics.get("jsonl_file"):
+        metrics.add_sink(JsonLinesSink(settings.metrics.jsonl_file))
+    if settings.metrics.get("prometheus_file"):
+        metrics.add_sink(PrometheusSink(settings.metrics.prometheus_file))
+
+
+def get_model_daemon() -> ModelDaemon:
+    return ModelDaemon(
+        (settings.daemon.get("host", "127.0.0.1"), settings.daemon.get("port", 6001)),
+        settings.daemon.get("authkey"),
+        os.path.join(settings.config.cache_path, "daemon.key"),
+    )
+
+
+def run_daemon_job(workers: int = 1) -> dict:
+    # The job's own metrics go back to the client for --profile
+    with metrics.collect() as job_metrics:
+        get_vocabulary_from_video(workers)
+    return job_metrics.get_summary()
+
+
+def run_command(command: str, workers: int, daemon: bool) -> Optional[dict]:
+    # Returns the metrics of a job run in the daemon
     if command == "conversation":
         generate_conversation()
     elif command == "anki_deck":
-        get_vocabulary_from_video()
+        if daemon:
+            return get_model_daemon().submit("anki_deck", workers=workers)
+        get_vocabulary_from_video(workers)
+    elif command == "import_corpus":
+        import_corpus()
+    elif command == "serve":
+        get_model_daemon().serve(
+            {
+                "anki_deck": run_daemon_job,
+                "load_times": model_registry.get_load_times,
+                "metrics": metrics.get_summary,
+            }
+        )
+    elif command == "stop":
+        get_model_daemon().submit("shutdown")
+
+
+@click.command()
+@click.argument(
+    "command",
+    type=click.Choice(["conversation", "anki_deck", "import_corpus", "serve", "stop"]),
+)
+@click.option(
+    "--workers",
+    default=1,
+    help="Processes extracting and diarizing input files in parallel.",
+)
+@click.option(
+    "--daemon",
+    is_flag=True,
+    help="Submit the job to the running `serve` process and its loaded models.",
+)
+@click.option(
+    "--profile",
+    is_flag=True,
+    help="Print the time spent in each pipeline stage at exit (with --daemon, "
+    "the stages of the job run in the daemon).",
+)
+def app(command: str, workers: int, daemon: bool, profile: bool):
+    add_metrics_sinks()
+    daemon_summary = None
+    try:
+        daemon_summary = run_command(command, workers, daemon)
+    finally:
+        metrics.close()
+        if profile:
+            metrics.print_summary(daemon_summary)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,500 @@
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from importlib.util import find_spec
+from typing import Dict, List, Tuple
+import click
+import numpy as np
+
+SAMPLE_RATE = 16000
+# Conjugation -> (infinitive, conjugation gloss, infinitive gloss)
+VERBS = {
+    "tengo": ("tener", "I have", "To have"),
+    "tienes": ("tener", "You have", "To have"),
+    "es": ("ser", "It is", "To be"),
+    "quiero": ("querer", "I want", "To want"),
+    "busca": ("buscar", "He looks for", "To look for"),
+    "necesitamos": ("necesitar", "We need", "To need"),
+    "venden": ("vender", "They sell", "To sell"),
+    "compraste": ("comprar", "You bought", "To buy"),
+}
+NOUNS = {
+    "camisa": "shirt",
+    "tienda": "shop",
+    "precio": "price",
+    "zapatos": "shoes",
+    "mercado": "market",
+    "libro": "book",
+}
+# Small models, so transcription can be compared on any machine
+WHISPER_MODELS = {
+    "mlx": "mlx-community/whisper-tiny",
+    "faster": "tiny",
+    "openai": "tiny",
+}
+NUMBERS = ["uno", "dos", "tres", "cuatro", "cinco", "seis", "siete", "ocho"]
+
+
+def get_synthetic_sentences(count: int) -> List[str]:
+    # Unique sentences (so no stage can skip work as a duplicate) built from a
+    # small vocabulary the mock server knows how to tag and translate
+    verbs = list(VERBS)
+    nouns = list(NOUNS)
+    return [
+        f"{verbs[index % len(verbs)]} {nouns[index // len(verbs) % len(nouns)]} "
+        f"{NUMBERS[index % 7]} {index}"
+        for index in range(count)
+    ]
+
+
+def get_canned_response(system: str, user: str) -> str:
+    def tag(sentence: str) -> List[str]:
+        return [
+            f"{word}: {'verb' if word in VERBS else 'noun' if word in NOUNS else 'numeral'}"
+            for word in sentence.split()
+        ]
+
+    def translate(sentence: str) -> str:
+        return " ".join(
+            VERBS[word][1] if word in VERBS else NOUNS.get(word, word)
+            for word in sentence.split()
+        )
+
+    sentence = user.split("\n")[0].removeprefix("Sample sentence: ")
+    if system.startswith("For each numbered sentence"):
+        return json.dumps(
+            {number: tag(text) for number, text in json.loads(user).items()}
+        )
+    if system.startswith("Translate each numbered sentence"):
+        return json.dumps(
+            {number: translate(text) for number, text in json.loads(user).items()}
+        )
+    if system.startswith("In the text below"):
+        return "\n".join(tag(user))
+    if system.startswith("For the Spanish sentence below"):
+        words = user.split()
+        return json.dumps(
+            {
+                "translation": translate(user),
+                "verbs": [
+                    {
+                        "verb": word,
+                        "verb_en": VERBS[word][1],
+                        "infinitive": VERBS[word][0],
+                        "infinitive_en": VERBS[word][2],
+                    }
+                    for word in words
+                    if word in VERBS
+                ],
+                "nouns": [word for word in words if word in NOUNS],
+            }
+        )
+    if "list only the verbs" in system:
+        verbs = [word for word in sentence.split() if word in VERBS]
+        return "\n".join(f"{word}:{VERBS[word][0]}" for word in verbs) or "-"
+    if "list only the non-proper nouns" in system:
+        return "\n".join(word for word in sentence.split() if word in NOUNS) or "-"
+    if "translate the Spanish verb" in system:
+        verbs = [
+            line.split(":")[0].strip()
+            for line in user.split("Verbs:\n", 1)[-1].split("\n")
+            if ":" in line
+        ]
+        return (
+            "".join(
+                f"{verb}:{VERBS[verb][1]}\n{VERBS[verb][0]}:{VERBS[verb][2]}\n---\n"
+                for verb in verbs
+                if verb in VERBS
+            ).rstrip("\n")
+            or "-"
+        )
+    if system.lstrip('"').startswith("Translate the following sentence"):
+        return translate(user)
+    return "Hola, ¿en qué te puedo ayudar?"
+
+
+class MockLLMServer:
+    def __init__(
+        self,
+        latency: float = 0.05,
+        error_rate: float = 0.0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.errors = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                request = json.loads(
+                    self.rfile.read(int(self.headers["Content-Length"]))
+                )
+                with server.lock:
+                    server.requests += 1
+                    failed = random.random() < server.error_rate
+                    server.errors += failed
+                if failed:
+                    # Stands in for an overloaded or restarting server
+                    body = b'{"error": {"message": "Server error", "type": "server_error"}}'
+                    self.send_response(503)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                messages = request.get("messages", [])
+                system = next(
+                    (m["content"] for m in messages if m["role"] == "system"), ""
+                )
+                user = next(
+                    (m["content"] for m in reversed(messages) if m["role"] == "user"),
+                    "",
+                )
+                content = get_canned_response(system, user)
+                time.sleep(server.latency)
+                body = json.dumps(
+                    {
+                        "id": f"chatcmpl-{server.requests}",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": request.get("model", "mock"),
+                        "choices": [
+                            {
+                                "index": 0,
+                                "message": {"role": "assistant", "content": content},
+                                "finish_reason": "stop",
+                            }
+                        ],
+                        "usage": {
+                            "prompt_tokens": sum(
+                                len(m["content"]) // 4 + 1 for m in messages
+                            ),
+                            "completion_tokens": len(content) // 4 + 1,
+                            "total_tokens": 0,
+                        },
+                    }
+                ).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def write_synthetic_audio(
+    audio_file: str, turns: int, turn_duration: float = 3.0, gap: float = 0.5
+) -> List[Tuple[float, float, str]]:
+    # Alternating "speakers" (tones of different pitch under noise) separated
+    # by silence, standing in for diarization output
+    rng = np.random.default_rng(0)
+    buffers = []
+    speaker_turns = []
+    position = 0.0
+    for turn in range(turns):
+        t = np.arange(int(turn_duration * SAMPLE_RATE)) / SAMPLE_RATE
+        frequency = 180.0 if turn % 2 else 120.0
+        voice = (
+            0.3 * np.sin(2 * np.pi * frequency * t) * (1 + np.sin(2 * np.pi * 3 * t))
+        )
+        buffers.append(voice + 0.02 * rng.standard_normal(len(t)))
+        buffers.append(np.zeros(int(gap * SAMPLE_RATE)))
+        speaker_turns.append(
+            (position, position + turn_duration, f"SPEAKER_{turn % 2:02d}")
+        )
+        position += turn_duration + gap
+    audio = np.clip(np.concatenate(buffers), -1.0, 1.0)
+    with wave.open(audio_file, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(SAMPLE_RATE)
+        wav_file.writeframes((audio * 32767).astype(np.int16).tobytes())
+    return speaker_turns
+
+
+def get_peak_rss_mb() -> float:
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes on Linux
+    return peak_rss / (1 << 20) if sys.platform == "darwin" else peak_rss / 1024
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except OSError:
+        return ""
+
+
+class Benchmark:
+    def __init__(self, servers: List[MockLLMServer]):
+        self.servers = servers
+        self.stages: Dict[str, dict] = {}
+
+    @contextmanager
+    def stage(self, name: str, items: int):
+        requests = self.get_requests()
+        start = time.perf_counter()
+        yield
+        wall_time = time.perf_counter() - start
+        llm_requests = self.get_requests() - requests
+        self.stages[name] = {
+            "wall_time": wall_time,
+            "items": items,
+            "items_per_second": items / wall_time if wall_time else 0.0,
+            "llm_requests": llm_requests,
+            "requests_per_second": llm_requests / wall_time if wall_time else 0.0,
+            "peak_rss_mb": get_peak_rss_mb(),
+        }
+        print(f"{name}: {wall_time:.2f}s, {items} items, {llm_requests} requests")
+
+    def get_requests(self) -> int:
+        return sum(server.requests for server in self.servers)
+
+    def skip(self, name: str, reason: str):
+        self.stages[name] = {"skipped": reason}
+        print(f"{name}: skipped ({reason})")
+
+
+def run_benchmark(
+    work_path: str,
+    sentences: int,
+    latency: float,
+    concurrency: int,
+    batch_size: int,
+    structured: bool,
+    threads: int = 0,
+    endpoints: int = 1,
+    error_rate: float = 0.0,
+) -> dict:
+    from anki_deck_generation import AnkiDeckGeneration
+    from corpus_store import CorpusStore
+    from lemma_index import LemmaIndex
+    from llm_client import LLMClient
+    from metrics import metrics
+    from pipeline_manifest import PipelineManifest
+    from transcription_backends import get_default_device, resolve_backend
+    from video_transcription import VideoTranscription
+    from vocabulary_extraction import VocabularyExtraction
+    from vocabulary_pipeline import VocabularyPipeline
+    from vocabulary_translation import VocabularyTranslation
+
+    video = "benchmark"
+    text_path = os.path.join(work_path, "output_text")
+    audio_path = os.path.join(work_path, "output_audio")
+    servers = [MockLLMServer(latency, error_rate) for _ in range(endpoints)]
+    for server in servers:
+        server.start()
+    benchmark = Benchmark(servers)
+    # Packages are written to the working directory
+    working_directory = os.getcwd()
+    os.chdir(work_path)
+    try:
+        device = get_default_device()
+        try:
+            whisper_backend = resolve_backend("auto", device)
+        except RuntimeError:
+            whisper_backend = None
+        corpus_store = CorpusStore(os.path.join(text_path, "corpus.sqlite"))
+        video_transcription = VideoTranscription(
+            "",
+            audio_path,
+            text_path,
+            os.path.join(work_path, "temp"),
+            WHISPER_MODELS.get(whisper_backend),
+            device,
+            corpus_store=corpus_store,
+            whisper_backend=whisper_backend,
+            threads=threads,
+            merge_gap=0.5,
+            min_duration=0.6,
+            max_duration=30,
+            energy_threshold=0.01,
+            min_speech_ratio=0.2,
+        )
+        audio_file = os.path.join(audio_path, f"{video}.wav")
+        speaker_turns = write_synthetic_audio(audio_file, sentences)
+
+        # What split_sentences maps the file with
+        with benchmark.stage("open_audio", 1):
+            video_transcription.open_audio(audio_file)
+
+        # pyannote needs a gated model, the synthetic turns stand in for its
+        # output and everything after it (segmentation, slicing) runs as is
+        video_transcription.diarize_window = lambda samples: speaker_turns
+        with benchmark.stage("split_audio", len(speaker_turns)):
+            segments = list(video_transcription.split_sentences(audio_file))
+
+        if whisper_backend:
+            # Loaded up front so the stage only times transcription
+            video_transcription.transcription_backend
+            with benchmark.stage("transcribe", len(segments)):
+                video_transcription.transcribe_segments(segments)
+        else:
+            benchmark.skip("transcribe", "no transcription backend is installed")
+        # Transcripts are replaced by the synthetic sentences either way, so
+        # the vocabulary stages see the same input on every machine
+        transcripts = [
+            (text, video_transcription.write_transcript(text, video, clip_name))
+            for text, (_, _, clip_name) in zip(
+                get_synthetic_sentences(len(segments)), segments
+            )
+        ]
+
+        manifest = PipelineManifest(os.path.join(work_path, "manifest.sqlite"))
+        lemma_index = LemmaIndex(os.path.join(work_path, "lemmas.sqlite"))
+        llm_client = LLMClient(
+            servers[0].url,
+            "sk-benchmark",
+            endpoints=[{"url": server.url} for server in servers],
+            max_in_flight=concurrency,
+            retry_delay=0.1,
+        )
+        vocabulary_pipeline = VocabularyPipeline(
+            VocabularyExtraction(
+                servers[0].url,
+                "sk-benchmark",
+                text_path,
+                "mock",
+                llm_client=llm_client,
+            ),
+            VocabularyTranslation(
+                servers[0].url,
+                "sk-benchmark",
+                text_path,
+                "mock",
+                lemma_index=lemma_index,
+                llm_client=llm_client,
+            ),
+            concurrency,
+            batch_size,
+            structured,
+            manifest,
+            corpus_store,
+        )
+        with benchmark.stage("vocabulary", len(transcripts)):
+            vocabulary_pipeline.run(transcripts)
+        lemma_index.close()
+
+        if find_spec("genanki"):
+            anki_deck_generation = AnkiDeckGeneration(
+                video, text_path, corpus_store, manifest
+            )
+            with benchmark.stage("anki_deck", len(transcripts)):
+                anki_deck_generation.generate_deck(
+                    anki_deck_generation.get_deck_content()
+                )
+        else:
+            benchmark.skip("anki_deck", "genanki is not installed")
+        manifest.close()
+        corpus_store.close()
+    finally:
+        os.chdir(working_directory)
+        for server in servers:
+            server.stop()
+
+    return {
+        "commit": get_commit(),
+        "timestamp": time.time(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "options": {
+            "sentences": sentences,
+            "latency": latency,
+            "concurrency": concurrency,
+            "batch_size": batch_size,
+            "structured": structured,
+            "threads": threads,
+            "whisper_backend": whisper_backend,
+            "endpoints": endpoints,
+            "error_rate": error_rate,
+        },
+        "stages": benchmark.stages,
+        "llm_requests": benchmark.get_requests(),
+        "llm_requests_per_endpoint": [server.requests for server in servers],
+        "llm_errors": sum(server.errors for server in servers),
+        "metrics": metrics.get_summary(),
+        "peak_rss_mb": get_peak_rss_mb(),
+    }
+
+
+@click.command()
+@click.option("--sentences", default=200, help="Synthetic segments to process.")
+@click.option(
+    "--latency", default=0.05, help="Seconds the mock server takes per request."
+)
+@click.option("--concurrency", default=8, help="Sentences processed concurrently.")
+@click.option("--batch-size", default=1, help="Sentences packed into one prompt.")
+@click.option("--structured", is_flag=True, help="Use the JSON schema extraction mode.")
+@click.option("--threads", default=0, help="CPU threads for transcription.")
+@click.option("--endpoints", default=1, help="Mock servers to balance requests over.")
+@click.option(
+    "--error-rate", default=0.0, help="Share of requests the mock servers fail."
+)
+@click.option("--output", default="benchmark.json", help="File the results go to.")
+def benchmark(
+    sentences: int,
+    latency: float,
+    concurrency: int,
+    batch_size: int,
+    structured: bool,
+    threads: int,
+    endpoints: int,
+    error_rate: float,
+    output: str,
+):
+    with tempfile.TemporaryDirectory() as work_path:
+        results = run_benchmark(
+            work_path,
+            sentences,
+            latency,
+            concurrency,
+            batch_size,
+            structured,
+            threads,
+            endpoints,
+            error_rate,
+        )
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Peak RSS: {results['peak_rss_mb']:.1f} MB, results written to {output}")
+
+
+if __name__ == "__main__":
+    benchmark()
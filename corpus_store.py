@@ -0,0 +1,177 @@
+import glob
+import os
+import re
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Clip names look like [00012].SPEAKER_01.[00345.004] (number, speaker, start
+# second and duration)
+CLIP_NAME_PATTERN = re.compile(r"^\[(\d+)\]\.(.*)\.\[(\d+)\.(\d+)\]$")
+SEGMENT_FIELDS = [
+    "transcript",
+    "pos",
+    "verbs",
+    "nouns",
+    "translation",
+    "translated_verbs",
+]
+# Per-clip text file suffix of each field, as written under output_text_path
+FILE_SUFFIXES = {
+    "transcript": "",
+    "verbs": "-verbs",
+    "nouns": "-nouns",
+    "translation": "-translated",
+    "translated_verbs": "-translated_verbs",
+}
+
+
+def parse_translated_verbs(translated_verbs: str) -> List[Tuple[str, str, str, str]]:
+    # Blocks of "verb:translation", "infinitive:translation" separated by ---
+    verbs = []
+    for block in translated_verbs.split("---"):
+        lines = [line for line in block.strip().split("\n") if line.strip()]
+        if len(lines) < 2:
+            continue
+        try:
+            verb_es, verb_en = lines[0].split(":", 1)
+            infinitive_es, infinitive_en = lines[1].split(":", 1)
+        except ValueError:
+            print(f"Error in verbs: {block.strip()}")
+            continue
+        verbs.append(
+            (
+                verb_es.strip(),
+                verb_en.strip(),
+                infinitive_es.strip(),
+                infinitive_en.strip(),
+            )
+        )
+    return verbs
+
+
+class CorpusStore:
+    def __init__(self, corpus_file: str = "output_text/corpus.sqlite"):
+        corpus_directory = os.path.dirname(corpus_file)
+        if corpus_directory and not os.path.exists(corpus_directory):
+            os.makedirs(corpus_directory)
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(corpus_file, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(f"""CREATE TABLE IF NOT EXISTS segments (
+                video TEXT NOT NULL,
+                clip_name TEXT NOT NULL,
+                clip_number INTEGER,
+                speaker TEXT,
+                start INTEGER,
+                duration INTEGER,
+                {", ".join(f"{field} TEXT" for field in SEGMENT_FIELDS)},
+                PRIMARY KEY (video, clip_name)
+            )""")
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS segments_video_start ON segments (video, start)"
+        )
+        self.connection.commit()
+
+    def parse_clip_name(self, clip_name: str) -> Tuple[int, str, int, int]:
+        match = CLIP_NAME_PATTERN.match(clip_name)
+        if not match:
+            return None, None, None, None
+        clip_number, speaker, start, duration = match.groups()
+        return int(clip_number), speaker, int(start), int(duration)
+
+    def get_segment_key(self, sentence_output_path: str) -> Tuple[str, str]:
+        # output_text_path/<video>/<clip_name>.txt -> (video, clip_name)
+        path = Path(sentence_output_path)
+        return path.parent.name, path.stem
+
+    def put_segments(self, segments: Iterable[Dict[str, str]]):
+        # Each segment is a dict with video, clip_name and any of SEGMENT_FIELDS,
+        # fields that are left out keep their stored value
+        segments = list(segments)
+        with self.lock:
+            self.connection.executemany(
+                """INSERT INTO segments
+                (video, clip_name, clip_number, speaker, start, duration)
+                VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT DO NOTHING""",
+                [
+                    (
+                        segment["video"],
+                        segment["clip_name"],
+                        *self.parse_clip_name(segment["clip_name"]),
+                    )
+                    for segment in segments
+                ],
+            )
+            for field in SEGMENT_FIELDS:
+                values = [
+                    (segment[field], segment["video"], segment["clip_name"])
+                    for segment in segments
+                    if segment.get(field) is not None
+                ]
+                if values:
+                    self.connection.executemany(
+                        f"""UPDATE segments SET {field} = ?
+                        WHERE video = ? AND clip_name = ?""",
+                        values,
+                    )
+            self.connection.commit()
+
+    def put_segment(self, video: str, clip_name: str, **fields: str):
+        self.put_segments([{"video": video, "clip_name": clip_name, **fields}])
+
+    def get_segment(self, video: str, clip_name: str) -> Optional[Dict[str, str]]:
+        segments = self.get_segments(video, clip_name)
+        return segments[0] if segments else None
+
+    def get_segments(self, video: str = None, clip_name: str = None) -> List[Dict]:
+        query = "SELECT * FROM segments"
+        conditions = []
+        parameters = []
+        if video is not None:
+            conditions.append("video = ?")
+            parameters.append(video)
+        if clip_name is not None:
+            conditions.append("clip_name = ?")
+            parameters.append(clip_name)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY video, start, clip_number"
+        with self.lock:
+            cursor = self.connection.execute(query, parameters)
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def get_videos(self) -> List[str]:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT DISTINCT video FROM segments ORDER BY video"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def import_directory(self, text_path: str, batch_size: int = 1000) -> int:
+        # One-time import of the per-clip text files written under text_path
+        segments = []
+        imported = 0
+        for transcript_path in glob.glob(os.path.join(text_path, "*", "*].txt")):
+            video, clip_name = self.get_segment_key(transcript_path)
+            segment = {"video": video, "clip_name": clip_name}
+            for field, suffix in FILE_SUFFIXES.items():
+                field_path = os.path.join(text_path, video, f"{clip_name}{suffix}.txt")
+                if os.path.exists(field_path):
+                    with open(field_path, "r", encoding="utf-8") as f:
+                        segment[field] = f.read()
+            segments.append(segment)
+            if len(segments) >= batch_size:
+                self.put_segments(segments)
+                imported += len(segments)
+                segments = []
+        self.put_segments(segments)
+        return imported + len(segments)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
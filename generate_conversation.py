@@ -1,8 +1,17 @@
-from openai import OpenAI
+import re
+import threading
+import time
+from typing import List, Tuple
 
+from llm_client import LLMClient
+from metrics import metrics
 from microphone_transcription import MicrophoneTranscription
+from speech_cache import SpeechCache
 from speech_generation import SpeechGeneration
 
+# Split after sentence ending punctuation (and any closing quotes) + whitespace
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?…][\"'”»)])\s+|(?<=[.!?…])\s+")
+
 
 class GenerateConversation:
     def __init__(
@@ -12,17 +21,58 @@ class GenerateConversation:
         model: str = "llama-3.3-70b-instruct",
         language: str = "es",
         prompt: str = "",
+        stream: bool = True,
+        llm_client: LLMClient = None,
+        speech_cache: SpeechCache = None,
+        prewarm_phrases: List[str] = None,
     ):
         self.prompt = prompt
         self.language = language
-        self.client = OpenAI(base_url=openai_url, api_key=openai_key)
+        self.client = llm_client or LLMClient(openai_url, openai_key)
         self.model = model
+        self.stream = stream
         self.speech_generation = SpeechGeneration(
             "models",
             "es_MX-claude-14947-epoch-high.onnx",
+            speech_cache,
         )
+        # Stock phrases play from the cache instead of waiting on Piper
+        self.speech_generation.prewarm(prewarm_phrases or ["Hola"])
         self.microphone_transcription = MicrophoneTranscription(language=language)
 
+    def split_sentences(self, text: str) -> Tuple[List[str], str]:
+        parts = SENTENCE_BOUNDARY.split(text)
+        return [part.strip() for part in parts[:-1] if part.strip()], parts[-1]
+
+    def stream_response(self, messages: list[dict]) -> str:
+        request_time = time.perf_counter()
+        first_audio_logged = threading.Event()
+
+        def on_playback_start():
+            if not first_audio_logged.is_set():
+                first_audio_logged.set()
+                print(f"Time to first audio: {time.perf_counter() - request_time:.2f}s")
+                metrics.record("first_audio", time.perf_counter() - request_time)
+
+        agent_response = ""
+        pending_text = ""
+        try:
+            for content in self.client.stream(self.model, messages, 0.5):
+                agent_response += content
+                pending_text += content
+                complete_sentences, pending_text = self.split_sentences(pending_text)
+                # Spoken while the model keeps generating the rest of the reply
+                for sentence in complete_sentences:
+                    self.speech_generation.speak_async(sentence, on_playback_start)
+            if pending_text.strip():
+                self.speech_generation.speak_async(
+                    pending_text.strip(), on_playback_start
+                )
+            metrics.record("llm_response", time.perf_counter() - request_time)
+        finally:
+            self.speech_generation.wait()
+        return agent_response
+
     def generate(self):
         messages = [
             {
@@ -40,16 +90,13 @@ class GenerateConversation:
                     "content": client_dialogue,
                 }
             )
-            converation_completion = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=0.5,
-                timeout=800,
-            )
-
-            agent_response = converation_completion.choices[0].message.content
-            print(f"Agent: {agent_response}")
-            self.speech_generation.generate_speech(agent_response)
+            if self.stream:
+                agent_response = self.stream_response(messages)
+                print(f"Agent: {agent_response}")
+            else:
+                agent_response = self.client.complete(self.model, messages, 0.5)
+                print(f"Agent: {agent_response}")
+                self.speech_generation.generate_speech(agent_response)
             messages.append(
                 {
                     "role": "assistant",
@@ -0,0 +1,144 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+class LemmaIndex:
+    def __init__(self, index_file: str = "output_text/lemmas.sqlite"):
+        index_directory = os.path.dirname(index_file)
+        if index_directory and not os.path.exists(index_directory):
+            os.makedirs(index_directory)
+
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(index_file, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript("""CREATE TABLE IF NOT EXISTS lemmas (
+                infinitive TEXT PRIMARY KEY,
+                infinitive_es TEXT NOT NULL,
+                gloss TEXT NOT NULL,
+                frequency INTEGER NOT NULL,
+                example_es TEXT,
+                first_seen REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS forms (
+                form TEXT NOT NULL,
+                infinitive TEXT NOT NULL,
+                verb_es TEXT NOT NULL,
+                gloss TEXT NOT NULL,
+                frequency INTEGER NOT NULL,
+                PRIMARY KEY (form, infinitive)
+            );
+            CREATE TABLE IF NOT EXISTS lemma_videos (
+                infinitive TEXT NOT NULL,
+                video TEXT NOT NULL,
+                PRIMARY KEY (infinitive, video)
+            );""")
+        self.connection.commit()
+
+    def normalize(self, word: str) -> str:
+        return word.strip().lower()
+
+    def lookup(self, verb_es: str, infinitive_es: str) -> Optional[Tuple[str, str]]:
+        # The conjugated form's gloss and the lemma's canonical gloss, if both
+        # have been translated before
+        with self.lock:
+            row = self.connection.execute(
+                """SELECT forms.gloss, lemmas.gloss FROM forms
+                JOIN lemmas ON lemmas.infinitive = forms.infinitive
+                WHERE forms.form = ? AND forms.infinitive = ?""",
+                (self.normalize(verb_es), self.normalize(infinitive_es)),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row
+
+    def record(
+        self,
+        verb_es: str,
+        verb_en: str,
+        infinitive_es: str,
+        infinitive_en: str,
+        example_es: str = None,
+        video: str = None,
+    ):
+        infinitive = self.normalize(infinitive_es)
+        with self.lock:
+            # The first gloss seen for a lemma stays its canonical gloss
+            self.connection.execute(
+                """INSERT INTO lemmas VALUES (?, ?, ?, 1, ?, ?)
+                ON CONFLICT (infinitive) DO UPDATE SET frequency = frequency + 1""",
+                (
+                    infinitive,
+                    infinitive_es.strip(),
+                    infinitive_en.strip(),
+                    example_es,
+                    time.time(),
+                ),
+            )
+            self.connection.execute(
+                """INSERT INTO forms VALUES (?, ?, ?, ?, 1)
+                ON CONFLICT (form, infinitive) DO UPDATE SET frequency = frequency + 1""",
+                (self.normalize(verb_es), infinitive, verb_es.strip(), verb_en.strip()),
+            )
+            if video:
+                self.connection.execute(
+                    "INSERT OR IGNORE INTO lemma_videos VALUES (?, ?)",
+                    (infinitive, video),
+                )
+            self.connection.commit()
+
+    def get_lemma(self, infinitive_es: str) -> Optional[Dict]:
+        infinitive = self.normalize(infinitive_es)
+        with self.lock:
+            row = self.connection.execute(
+                """SELECT infinitive_es, gloss, frequency, example_es, first_seen
+                FROM lemmas WHERE infinitive = ?""",
+                (infinitive,),
+            ).fetchone()
+            if row is None:
+                return None
+            videos = self.connection.execute(
+                "SELECT video FROM lemma_videos WHERE infinitive = ? ORDER BY video",
+                (infinitive,),
+            ).fetchall()
+        infinitive_es, gloss, frequency, example_es, first_seen = row
+        return {
+            "infinitive_es": infinitive_es,
+            "gloss": gloss,
+            "frequency": frequency,
+            "example_es": example_es,
+            "first_seen": first_seen,
+            "videos": [video for video, in videos],
+        }
+
+    def get_most_frequent(self, limit: int = 100) -> List[Tuple[str, str, int]]:
+        with self.lock:
+            return self.connection.execute(
+                """SELECT infinitive_es, gloss, frequency FROM lemmas
+                ORDER BY frequency DESC LIMIT ?""",
+                (limit,),
+            ).fetchall()
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            lemmas = self.connection.execute("SELECT COUNT(*) FROM lemmas").fetchone()[
+                0
+            ]
+        lookups = self.hits + self.misses
+        return {
+            "lemmas": lemmas,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
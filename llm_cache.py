@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+
+class LLMCache:
+    def __init__(
+        self,
+        cache_file: str = "cache/llm_cache.sqlite",
+        max_entries: int = 200000,
+        max_age_days: float = 90,
+    ):
+        cache_directory = os.path.dirname(cache_file)
+        if cache_directory and not os.path.exists(cache_directory):
+            os.makedirs(cache_directory)
+
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(cache_file, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS completions (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )""")
+        self.connection.execute("""CREATE INDEX IF NOT EXISTS completions_last_used
+            ON completions (last_used)""")
+        self.connection.commit()
+        self.evict()
+
+    def get_key(
+        self,
+        model: str,
+        messages: list[dict],
+        temperature: float,
+        response_format: dict = None,
+    ) -> str:
+        request = {"model": model, "messages": messages, "temperature": temperature}
+        if response_format:
+            request["response_format"] = response_format
+        payload = json.dumps(request, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(
+        self,
+        model: str,
+        messages: list[dict],
+        temperature: float,
+        response_format: dict = None,
+    ) -> Optional[str]:
+        key = self.get_key(model, messages, temperature, response_format)
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT content FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.connection.execute(
+                "UPDATE completions SET last_used = ? WHERE key = ?",
+                (time.time(), key),
+            )
+            self.connection.commit()
+            return row[0]
+
+    def put(
+        self,
+        model: str,
+        messages: list[dict],
+        temperature: float,
+        content: str,
+        response_format: dict = None,
+    ):
+        key = self.get_key(model, messages, temperature, response_format)
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?)",
+                (key, model, content, now, now),
+            )
+            self.connection.commit()
+
+    def evict(self):
+        with self.lock:
+            if self.max_age_days:
+                self.connection.execute(
+                    "DELETE FROM completions WHERE created < ?",
+                    (time.time() - self.max_age_days * 86400,),
+                )
+            if self.max_entries:
+                # Drop the least recently used entries beyond the size limit
+                self.connection.execute(
+                    """DELETE FROM completions WHERE key IN (
+                        SELECT key FROM completions
+                        ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                    )""",
+                    (self.max_entries,),
+                )
+            self.connection.commit()
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            entries = self.connection.execute(
+                "SELECT COUNT(*) FROM completions"
+            ).fetchone()[0]
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else 0.0,
+            "entries": entries,
+        }
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
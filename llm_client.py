@@ -0,0 +1,306 @@
+import asyncio
+import json
+import random
+import threading
+import time
+import weakref
+from typing import Iterable, List, Optional
+
+from openai import (
+    APIConnectionError,
+    AsyncOpenAI,
+    InternalServerError,
+    OpenAI,
+    RateLimitError,
+)
+
+from llm_cache import LLMCache
+from metrics import metrics
+
+# Failures worth another attempt (possibly on another endpoint), anything
+# else (bad request, auth) is raised straight away
+RETRYABLE_ERRORS = (APIConnectionError, RateLimitError, InternalServerError)
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token, good enough for packing prompts
+    return len(text) // 4 + 1
+
+
+def split_into_batches(texts: List[str], token_budget: int) -> List[List[int]]:
+    batches = []
+    batch = []
+    batch_tokens = 0
+    for index, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if batch and batch_tokens + tokens > token_budget:
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(index)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def parse_json_object(content: str) -> Optional[dict]:
+    if not content:
+        return None
+    start = content.find("{")
+    end = content.rfind("}")
+    if start == -1 or end < start:
+        return None
+    try:
+        result = json.loads(content[start : end + 1])
+    except ValueError:
+        return None
+    return result if isinstance(result, dict) else None
+
+
+class LLMEndpoint:
+    def __init__(
+        self,
+        url: str,
+        api_key: str,
+        max_in_flight: int = 8,
+        timeout: float = 800,
+    ):
+        self.url = url
+        self.max_in_flight = max(max_in_flight, 1)
+        self.in_flight = 0
+        self.unhealthy_until = 0.0
+        # One client per endpoint, so its connections are pooled and reused;
+        # LLMClient never has more than max_in_flight requests on it
+        self.client = OpenAI(
+            base_url=url, api_key=api_key, timeout=timeout, max_retries=0
+        )
+        self.async_client = AsyncOpenAI(
+            base_url=url, api_key=api_key, timeout=timeout, max_retries=0
+        )
+
+
+class LLMClient:
+    def __init__(
+        self,
+        openai_url: str,
+        openai_api_key: str,
+        llm_cache: LLMCache = None,
+        timeout: float = 800,
+        endpoints: List[dict] = None,
+        max_in_flight: int = 8,
+        max_retries: int = 3,
+        retry_delay: float = 1.0,
+    ):
+        # endpoints is a list of {"url", "api_key", "max_in_flight"} dicts, by
+        # default the single openai_url server
+        endpoints = endpoints or [{"url": openai_url, "api_key": openai_api_key}]
+        self.endpoints = [
+            LLMEndpoint(
+                endpoint["url"],
+                endpoint.get("api_key", openai_api_key),
+                endpoint.get("max_in_flight", max_in_flight),
+                timeout,
+            )
+            for endpoint in endpoints
+        ]
+        self.llm_cache = llm_cache
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.capacity = sum(endpoint.max_in_flight for endpoint in self.endpoints)
+        self.lock = threading.Lock()
+        # Callers wait here once every endpoint is saturated
+        self.released = threading.Condition(self.lock)
+        self.async_slots = weakref.WeakKeyDictionary()
+
+    def get_async_slots(self) -> asyncio.Semaphore:
+        # Semaphores belong to an event loop, and the daemon runs a new loop
+        # per job
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            if loop not in self.async_slots:
+                self.async_slots[loop] = asyncio.Semaphore(self.capacity)
+            return self.async_slots[loop]
+
+    def get_free_endpoint(self) -> Optional[LLMEndpoint]:
+        # Called with the lock held. Healthy endpoints first, an unhealthy one
+        # only when the healthy ones are full, and never past max_in_flight
+        now = time.monotonic()
+        endpoints = [
+            endpoint
+            for endpoint in self.endpoints
+            if endpoint.in_flight < endpoint.max_in_flight
+        ]
+        if not endpoints:
+            return None
+        endpoint = min(
+            endpoints,
+            key=lambda endpoint: (
+                endpoint.unhealthy_until > now,
+                endpoint.in_flight / endpoint.max_in_flight,
+            ),
+        )
+        endpoint.in_flight += 1
+        return endpoint
+
+    def acquire_endpoint(self) -> LLMEndpoint:
+        with self.lock:
+            endpoint = self.get_free_endpoint()
+            while endpoint is None:
+                self.released.wait()
+                endpoint = self.get_free_endpoint()
+            return endpoint
+
+    async def aacquire_endpoint(self) -> LLMEndpoint:
+        # The loop's semaphore keeps it within capacity, endpoints are only
+        # full here when other threads or loops share the client
+        while True:
+            with self.lock:
+                endpoint = self.get_free_endpoint()
+            if endpoint is not None:
+                return endpoint
+            await asyncio.sleep(0.05)
+
+    def release_endpoint(self, endpoint: LLMEndpoint, error: Exception = None):
+        with self.lock:
+            endpoint.in_flight -= 1
+            if isinstance(error, RETRYABLE_ERRORS):
+                # Steer the next requests to the other endpoints for a while
+                endpoint.unhealthy_until = time.monotonic() + self.retry_delay * 5
+            self.released.notify()
+
+    def log_retry(self, endpoint: LLMEndpoint, error: Exception):
+        metrics.increment("llm_retries")
+        print(f"{endpoint.url}: {error}, retrying")
+
+    def get_retry_delay(self, attempt: int) -> float:
+        # Full jitter exponential backoff
+        return random.uniform(0, min(self.retry_delay * 2**attempt, 30))
+
+    def record_usage(self, completion):
+        metrics.increment("llm_requests")
+        if completion.usage:
+            metrics.increment("llm_prompt_tokens", completion.usage.prompt_tokens)
+            metrics.increment(
+                "llm_completion_tokens", completion.usage.completion_tokens
+            )
+
+    def create(self, **options):
+        for attempt in range(self.max_retries + 1):
+            endpoint = self.acquire_endpoint()
+            error = None
+            try:
+                with metrics.timer("llm_request", endpoint=endpoint.url):
+                    return endpoint.client.chat.completions.create(**options)
+            except RETRYABLE_ERRORS as e:
+                error = e
+                if attempt == self.max_retries:
+                    raise
+            finally:
+                # Whatever happened, including non-retryable errors
+                self.release_endpoint(endpoint, error)
+            self.log_retry(endpoint, error)
+            time.sleep(self.get_retry_delay(attempt))
+
+    async def acreate(self, **options):
+        for attempt in range(self.max_retries + 1):
+            endpoint = await self.aacquire_endpoint()
+            error = None
+            try:
+                with metrics.timer("llm_request", endpoint=endpoint.url):
+                    return await endpoint.async_client.chat.completions.create(
+                        **options
+                    )
+            except RETRYABLE_ERRORS as e:
+                error = e
+                if attempt == self.max_retries:
+                    raise
+            finally:
+                # Also on cancellation
+                self.release_endpoint(endpoint, error)
+            self.log_retry(endpoint, error)
+            await asyncio.sleep(self.get_retry_delay(attempt))
+
+    def complete(
+        self,
+        model: str,
+        messages: list[dict],
+        temperature: float = 0.2,
+        response_format: dict = None,
+    ) -> str:
+        if self.llm_cache:
+            content = self.llm_cache.get(model, messages, temperature, response_format)
+            if content is not None:
+                metrics.increment("llm_cache_hits")
+                return content
+        options = {"response_format": response_format} if response_format else {}
+
+        completion = self.create(
+            model=model, messages=messages, temperature=temperature, **options
+        )
+        self.record_usage(completion)
+        content = completion.choices[0].message.content
+
+        if self.llm_cache and content is not None:
+            self.llm_cache.put(model, messages, temperature, content, response_format)
+        return content
+
+    async def acomplete(
+        self,
+        model: str,
+        messages: list[dict],
+        temperature: float = 0.2,
+        response_format: dict = None,
+    ) -> str:
+        if self.llm_cache:
+            content = self.llm_cache.get(model, messages, temperature, response_format)
+            if content is not None:
+                metrics.increment("llm_cache_hits")
+                return content
+        options = {"response_format": response_format} if response_format else {}
+
+        async with self.get_async_slots():
+            completion = await self.acreate(
+                model=model, messages=messages, temperature=temperature, **options
+            )
+        self.record_usage(completion)
+        content = completion.choices[0].message.content
+
+        if self.llm_cache and content is not None:
+            self.llm_cache.put(model, messages, temperature, content, response_format)
+        return content
+
+    def stream(
+        self, model: str, messages: list[dict], temperature: float = 0.2
+    ) -> Iterable[str]:
+        # Only opening the stream is retried, once text has been handed out
+        # the request can't be replayed
+        for attempt in range(self.max_retries + 1):
+            endpoint = self.acquire_endpoint()
+            try:
+                completion_stream = endpoint.client.chat.completions.create(
+                    model=model, messages=messages, temperature=temperature, stream=True
+                )
+            except BaseException as e:
+                self.release_endpoint(endpoint, e)
+                if not isinstance(e, RETRYABLE_ERRORS) or attempt == self.max_retries:
+                    raise
+                self.log_retry(endpoint, e)
+                time.sleep(self.get_retry_delay(attempt))
+                continue
+            break
+        metrics.increment("llm_requests")
+
+        # The endpoint counts as in flight until the reply has been read
+        error = None
+        try:
+            for chunk in completion_stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            completion_stream.close()
+            self.release_endpoint(endpoint, error)
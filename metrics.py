@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+
+class JsonLinesSink:
+    def __init__(self, metrics_file: str):
+        metrics_directory = os.path.dirname(metrics_file)
+        if metrics_directory and not os.path.exists(metrics_directory):
+            os.makedirs(metrics_directory)
+        self.lock = threading.Lock()
+        self.file = open(metrics_file, "a", encoding="utf-8")
+
+    def emit(self, event: dict):
+        with self.lock:
+            self.file.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+    def flush(self, timers: Dict[str, dict], counters: Dict[str, float]):
+        with self.lock:
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class PrometheusSink:
+    def __init__(self, metrics_file: str, prefix: str = "ai_language_learning"):
+        self.metrics_file = metrics_file
+        self.prefix = prefix
+
+    def emit(self, event: dict):
+        pass
+
+    def flush(self, timers: Dict[str, dict], counters: Dict[str, float]):
+        # Text exposition format, for node_exporter's textfile collector
+        lines = [
+            f"# TYPE {self.prefix}_stage_seconds summary",
+            *(
+                line
+                for name, timer in sorted(timers.items())
+                for line in (
+                    f'{self.prefix}_stage_seconds_count{{stage="{name}"}} {timer["count"]}',
+                    f'{self.prefix}_stage_seconds_sum{{stage="{name}"}} {timer["total"]}',
+                )
+            ),
+            f"# TYPE {self.prefix}_stage_seconds_max gauge",
+            *(
+                f'{self.prefix}_stage_seconds_max{{stage="{name}"}} {timer["max"]}'
+                for name, timer in sorted(timers.items())
+            ),
+            f"# TYPE {self.prefix}_total counter",
+            *(
+                f'{self.prefix}_total{{counter="{name}"}} {value}'
+                for name, value in sorted(counters.items())
+            ),
+        ]
+        temp_file = f"{self.metrics_file}.tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(temp_file, self.metrics_file)
+
+    def close(self):
+        pass
+
+
+class Metrics:
+    def __init__(self):
+        self.timers: Dict[str, dict] = {}
+        self.counters: Dict[str, float] = {}
+        self.sinks: List = []
+        self.collectors: List["Metrics"] = []
+        self.start_time = time.perf_counter()
+        self.lock = threading.Lock()
+
+    def add_sink(self, sink):
+        with self.lock:
+            self.sinks.append(sink)
+
+    def record(self, name: str, duration: float, **labels):
+        with self.lock:
+            timer = self.timers.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+            timer["count"] += 1
+            timer["total"] += duration
+            timer["max"] = max(timer["max"], duration)
+            sinks = list(self.sinks)
+            collectors = list(self.collectors)
+        for collector in collectors:
+            collector.record(name, duration)
+        event = {"time": time.time(), "stage": name, "seconds": duration, **labels}
+        for sink in sinks:
+            sink.emit(event)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start_time, **labels)
+
+    def increment(self, name: str, value: float = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            collectors = list(self.collectors)
+        for collector in collectors:
+            collector.increment(name, value)
+
+    @contextmanager
+    def collect(self):
+        # Timers and counters of one job (a daemon job), apart from the
+        # process totals
+        collector = Metrics()
+        with self.lock:
+            self.collectors.append(collector)
+        try:
+            yield collector
+        finally:
+            with self.lock:
+                self.collectors.remove(collector)
+
+    def get_summary(self) -> dict:
+        with self.lock:
+            return {
+                "wall_time": time.perf_counter() - self.start_time,
+                "timers": {name: dict(timer) for name, timer in self.timers.items()},
+                "counters": dict(self.counters),
+            }
+
+    def print_summary(self, summary: dict = None):
+        summary = summary or self.get_summary()
+        wall_time = summary["wall_time"]
+        print(f"Profile ({wall_time:.1f}s wall time):")
+        print(f"{'stage':<24}{'count':>8}{'total s':>10}{'mean ms':>10}{'max ms':>10}")
+        for name, timer in sorted(
+            summary["timers"].items(), key=lambda item: -item[1]["total"]
+        ):
+            print(
+                f"{name:<24}{timer['count']:>8}{timer['total']:>10.2f}"
+                f"{timer['total'] / timer['count'] * 1000:>10.1f}"
+                f"{timer['max'] * 1000:>10.1f}"
+            )
+        for name, value in sorted(summary["counters"].items()):
+            print(f"{name:<24}{value:>8g}")
+
+    def flush(self):
+        summary = self.get_summary()
+        with self.lock:
+            sinks = list(self.sinks)
+        for sink in sinks:
+            sink.flush(summary["timers"], summary["counters"])
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            sinks = self.sinks
+            self.sinks = []
+        for sink in sinks:
+            sink.close()
+
+
+# Shared by every component in the process; stages running in worker
+# processes (app.py anki_deck --workers) are only counted in those processes
+metrics = Metrics()
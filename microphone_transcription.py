@@ -1,8 +1,11 @@
-import io
+import queue
+from collections import deque
+from typing import Iterable
 import numpy as np
-import soundfile as sf
-import speech_recognition as sr
-import whisper
+
+from model_registry import model_registry
+
+SAMPLE_RATE = 16000
 
 
 class MicrophoneTranscription:
@@ -10,27 +13,136 @@ class MicrophoneTranscription:
         self,
         whisper_model="turbo",
         language="es",
+        frame_duration: float = 0.03,
+        speech_threshold: float = 0.01,
+        silence_duration: float = 0.6,
+        pre_roll_duration: float = 0.3,
+        partial_interval: float = 0.5,
+        max_utterance_duration: float = 30,
     ):
         self.language = language
-        self.whisper_model = whisper.load_model(whisper_model)
-        self.recogniser = sr.Recognizer()
+        self.whisper_model_name = whisper_model
+        self.frame_size = int(frame_duration * SAMPLE_RATE)
+        self.speech_threshold = speech_threshold
+        self.silence_frames = int(silence_duration / frame_duration)
+        self.pre_roll_frames = int(pre_roll_duration / frame_duration)
+        self.partial_interval = int(partial_interval * SAMPLE_RATE)
+        self.max_utterance_samples = int(max_utterance_duration * SAMPLE_RATE)
+
+    @property
+    def whisper_model(self):
+        import whisper
+
+        return model_registry.get(
+            f"openai_whisper:{self.whisper_model_name}",
+            lambda: whisper.load_model(self.whisper_model_name),
+        )
+
+    def microphone_frames(self) -> Iterable[np.ndarray]:
+        import sounddevice as sd
+
+        frames = queue.Queue()
+        with sd.InputStream(
+            samplerate=SAMPLE_RATE,
+            channels=1,
+            dtype="float32",
+            blocksize=self.frame_size,
+            callback=lambda indata, *_: frames.put(indata[:, 0].copy()),
+        ):
+            while True:
+                yield frames.get()
+
+    def file_frames(self, audio_path: str) -> Iterable[np.ndarray]:
+        import soundfile as sf
+
+        # Stand-in for the microphone so recorded audio can drive the listener
+        audio, sample_rate = sf.read(audio_path, dtype="float32", always_2d=True)
+        audio = audio.mean(axis=1)
+        if sample_rate != SAMPLE_RATE:
+            audio = np.interp(
+                np.arange(0, len(audio), sample_rate / SAMPLE_RATE),
+                np.arange(len(audio)),
+                audio,
+            ).astype(np.float32)
+        for start in range(0, len(audio), self.frame_size):
+            yield audio[start : start + self.frame_size]
+        # Trailing silence so an utterance at the very end is closed off
+        for _ in range(self.silence_frames + 1):
+            yield np.zeros(self.frame_size, dtype=np.float32)
+
+    def transcribe_audio(self, audio: np.ndarray) -> str:
+        import whisper
+
+        options = {
+            "language": self.language,
+            "task": "transcribe",
+            "fp16": False,
+        }
+        result = whisper.transcribe(self.whisper_model, audio, **options)
+        return result["text"]
+
+    def transcribe_stream(self, frames: Iterable[np.ndarray]) -> str:
+        utterance = np.zeros(self.max_utterance_samples, dtype=np.float32)
+        pre_roll = deque(maxlen=self.pre_roll_frames)
+        noise_floor = self.speech_threshold / 2
+        length = 0
+        speech_end = 0
+        silent_frames = 0
+        partial_text = ""
+        partial_end = 0
+
+        for frame in frames:
+            energy = float(np.sqrt(np.mean(np.square(frame)))) if len(frame) else 0.0
+            is_speech = energy > max(self.speech_threshold, noise_floor * 3)
+
+            if not length:
+                if not is_speech:
+                    noise_floor = 0.95 * noise_floor + 0.05 * energy
+                    pre_roll.append(frame)
+                    continue
+                for pre_roll_frame in pre_roll:
+                    utterance[length : length + len(pre_roll_frame)] = pre_roll_frame
+                    length += len(pre_roll_frame)
+                pre_roll.clear()
+
+            frame = frame[: self.max_utterance_samples - length]
+            utterance[length : length + len(frame)] = frame
+            length += len(frame)
+
+            if is_speech:
+                speech_end = length
+                silent_frames = 0
+            else:
+                silent_frames += 1
+
+            # Decode the utterance so far on a rolling basis, and as soon as
+            # the speaker pauses, so the text is ready when the pause turns
+            # out to be the end of speech.
+            if (speech_end - partial_end >= self.partial_interval) or (
+                silent_frames == 1 and speech_end > partial_end
+            ):
+                partial_text = self.transcribe_audio(utterance[:length])
+                partial_end = speech_end
+                print(f"... {partial_text}")
+
+            if silent_frames >= self.silence_frames or length >= len(utterance):
+                break
+
+        if not length:
+            return ""
+        if partial_end >= speech_end:
+            return partial_text
+        return self.transcribe_audio(utterance[:length])
+
+    def transcribe_file(self, audio_path: str) -> str:
+        return self.transcribe_stream(self.file_frames(audio_path))
 
     def listen(self):
-        with sr.Microphone() as source:
-            print("Say something!")
-            audio = self.recogniser.listen(source)
-
-            wav_bytes = audio.get_wav_data(convert_rate=16000)
-            wav_stream = io.BytesIO(wav_bytes)
-            audio_array, _ = sf.read(wav_stream)
-            audio_array = audio_array.astype(np.float32)
-
-            options = {
-                "language": self.language,
-                "task": "transcribe",
-                "fp16": False,
-            }
-            result = whisper.transcribe(self.whisper_model, audio_array, **options)
-            text = result["text"]
-            print(f"You said: {text}")
-            return text
+        print("Say something!")
+        frames = self.microphone_frames()
+        try:
+            text = self.transcribe_stream(frames)
+        finally:
+            frames.close()
+        print(f"You said: {text}")
+        return text
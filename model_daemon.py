@@ -0,0 +1,78 @@
+import os
+import secrets
+import stat
+import traceback
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from typing import Any, Callable, Dict, Tuple
+
+
+class ModelDaemon:
+    def __init__(
+        self,
+        address: Tuple[str, int] = ("127.0.0.1", 6001),
+        authkey: str = None,
+        authkey_file: str = "cache/daemon.key",
+    ):
+        self.address = address
+        self.authkey = authkey
+        self.authkey_file = authkey_file
+
+    def get_authkey(self, create: bool = False) -> bytes:
+        # The connection unpickles what it receives, so the key is what stops
+        # other local users from running code in the daemon. Without one in
+        # .secrets.toml, serve generates a random key only this user can read.
+        if self.authkey:
+            return self.authkey.encode("utf-8")
+        if not os.path.exists(self.authkey_file):
+            if not create:
+                raise RuntimeError(
+                    f"No daemon key in {self.authkey_file}, start `app.py serve` first"
+                )
+            authkey_directory = os.path.dirname(self.authkey_file)
+            if authkey_directory and not os.path.exists(authkey_directory):
+                os.makedirs(authkey_directory)
+            file_descriptor = os.open(
+                self.authkey_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600
+            )
+            with os.fdopen(file_descriptor, "w", encoding="utf-8") as f:
+                f.write(secrets.token_hex(32))
+        if os.stat(self.authkey_file).st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+            raise RuntimeError(
+                f"{self.authkey_file} is readable by other users, "
+                f"run chmod 600 {self.authkey_file}"
+            )
+        with open(self.authkey_file, "r", encoding="utf-8") as f:
+            return f.read().strip().encode("utf-8")
+
+    def serve(self, handlers: Dict[str, Callable[..., Any]]):
+        # Jobs run one at a time inside this process, so every model loaded
+        # through the registry stays resident between jobs
+        with Listener(self.address, authkey=self.get_authkey(True)) as listener:
+            print(f"Listening on {self.address[0]}:{self.address[1]}")
+            while True:
+                try:
+                    connection = listener.accept()
+                except (AuthenticationError, OSError) as e:
+                    # A client without the key doesn't take the daemon down
+                    print(f"Rejected connection: {e}")
+                    continue
+                with connection:
+                    command, options = connection.recv()
+                    if command == "shutdown":
+                        connection.send(("ok", None))
+                        break
+                    print(f"Running {command} {options}")
+                    try:
+                        connection.send(("ok", handlers[command](**options)))
+                    except Exception:
+                        traceback.print_exc()
+                        connection.send(("error", traceback.format_exc()))
+
+    def submit(self, command: str, **options) -> Any:
+        with Client(self.address, authkey=self.get_authkey()) as connection:
+            connection.send((command, options))
+            status, result = connection.recv()
+        if status == "error":
+            raise RuntimeError(f"{command} failed in the daemon:\n{result}")
+        return result
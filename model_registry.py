@@ -0,0 +1,48 @@
+import threading
+import time
+from typing import Any, Callable, Dict
+
+from metrics import metrics
+
+
+class ModelRegistry:
+    def __init__(self):
+        self.models: Dict[str, Any] = {}
+        self.load_times: Dict[str, float] = {}
+        self.lock = threading.Lock()
+        self.loading_locks: Dict[str, threading.Lock] = {}
+
+    def get(self, key: str, loader: Callable[[], Any]) -> Any:
+        with self.lock:
+            if key in self.models:
+                return self.models[key]
+            loading_lock = self.loading_locks.setdefault(key, threading.Lock())
+
+        # Only one thread loads a given model, the others wait for it
+        with loading_lock:
+            with self.lock:
+                if key in self.models:
+                    return self.models[key]
+            start_time = time.perf_counter()
+            model = loader()
+            load_time = time.perf_counter() - start_time
+            print(f"Loaded {key} in {load_time:.1f}s")
+            metrics.record("load_model", load_time, model=key)
+            with self.lock:
+                self.models[key] = model
+                self.load_times[key] = load_time
+        return model
+
+    def get_load_times(self) -> Dict[str, float]:
+        with self.lock:
+            return dict(self.load_times)
+
+    def unload(self, key: str):
+        with self.lock:
+            self.models.pop(key, None)
+            self.load_times.pop(key, None)
+
+
+# Shared by every component in the process, so each model is loaded once and
+# stays resident for as long as the process (e.g. the app daemon) lives
+model_registry = ModelRegistry()
@@ -0,0 +1,94 @@
+import multiprocessing
+import queue
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from video_transcription import VideoTranscription
+
+# Per worker process state, set up once by the pool initializer
+_video_transcription: VideoTranscription = None
+_segment_queue: multiprocessing.Queue = None
+
+
+def _init_worker(video_transcription_options: dict, segment_queue):
+    global _video_transcription, _segment_queue
+    _video_transcription = VideoTranscription(**video_transcription_options)
+    _segment_queue = segment_queue
+
+
+def _ingest_file(audio_file: str, video_file: str = None, video_hash: str = None):
+    if video_file:
+        _video_transcription.extract_audio(video_file, video_hash=video_hash)
+    for sentence_audio, clip_path, clip_name in _video_transcription.split_sentences(
+        audio_file
+    ):
+        # Copy the view so only the segment (not the episode) gets pickled
+        _segment_queue.put(
+            (audio_file, (np.array(sentence_audio), clip_path, clip_name))
+        )
+    _segment_queue.put((audio_file, None))
+
+
+def _terminate_workers(executor: ProcessPoolExecutor):
+    # Workers may be blocked on the full segment queue, so they are stopped
+    # rather than waited for (terminate_workers is only in Python 3.14+)
+    if hasattr(executor, "terminate_workers"):
+        executor.terminate_workers()
+        return
+    for process in list((executor._processes or {}).values()):
+        process.terminate()
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+class ParallelIngest:
+    def __init__(
+        self,
+        workers: int,
+        video_transcription_options: dict,
+        queue_size: int = 64,
+    ):
+        self.workers = workers
+        self.video_transcription_options = video_transcription_options
+        self.queue_size = queue_size
+
+    def split_files(
+        self, jobs: List[Tuple[str, Optional[str], Optional[str]]]
+    ) -> Iterable[Tuple[str, Optional[Tuple[np.ndarray, str, str]]]]:
+        # Jobs are (audio_file, video_file, video_hash), the video is extracted
+        # first when given. Yields (audio_file, segment) as workers produce
+        # them and (audio_file, None) once a file is done.
+        if not jobs:
+            return
+        context = multiprocessing.get_context("spawn")
+        segment_queue = context.Queue(self.queue_size)
+        executor = ProcessPoolExecutor(
+            min(self.workers, len(jobs)),
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self.video_transcription_options, segment_queue),
+        )
+        completed = False
+        try:
+            futures = [executor.submit(_ingest_file, *job) for job in jobs]
+            remaining = len(jobs)
+            while remaining:
+                try:
+                    audio_file, segment = segment_queue.get(timeout=1)
+                except queue.Empty:
+                    # A worker that raised, or died (OOM kill, crash in native
+                    # code: BrokenProcessPool), never sends its file's end
+                    for future in futures:
+                        if future.done() and future.exception():
+                            raise future.exception()
+                    continue
+                if segment is None:
+                    remaining -= 1
+                yield audio_file, segment
+            completed = True
+        finally:
+            if completed:
+                executor.shutdown()
+            else:
+                _terminate_workers(executor)
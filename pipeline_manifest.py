@@ -0,0 +1,76 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import List
+
+
+class PipelineManifest:
+    def __init__(self, manifest_file: str = "output_text/manifest.sqlite"):
+        manifest_directory = os.path.dirname(manifest_file)
+        if manifest_directory and not os.path.exists(manifest_directory):
+            os.makedirs(manifest_directory)
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(manifest_file, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS stages (
+                item TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                input_hash TEXT NOT NULL,
+                completed REAL NOT NULL,
+                PRIMARY KEY (item, stage)
+            )""")
+        self.connection.commit()
+
+    def get_hash_from_string(self, *strings: str) -> str:
+        m = hashlib.sha256()
+        for string in strings:
+            m.update(string.encode("utf-8"))
+            m.update(b"\0")
+        return m.hexdigest()
+
+    def is_done(self, item: str, stage: str, input_hash: str) -> bool:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT input_hash FROM stages WHERE item = ? AND stage = ?",
+                (item, stage),
+            ).fetchone()
+        return row is not None and row[0] == input_hash
+
+    def are_done(self, item: str, stages: List[str], input_hash: str) -> bool:
+        return all(self.is_done(item, stage, input_hash) for stage in stages)
+
+    def mark_done(self, item: str, stage: str, input_hash: str):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO stages VALUES (?, ?, ?, ?)",
+                (item, stage, input_hash, time.time()),
+            )
+            self.connection.commit()
+
+    def get_items(self, item_prefix: str, stage: str, input_hash: str) -> List[str]:
+        with self.lock:
+            rows = self.connection.execute(
+                """SELECT item FROM stages
+                WHERE substr(item, 1, ?) = ? AND stage = ? AND input_hash = ?
+                ORDER BY item""",
+                (len(item_prefix), item_prefix, stage, input_hash),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def invalidate(self, item: str, stage: str = None):
+        with self.lock:
+            if stage:
+                self.connection.execute(
+                    "DELETE FROM stages WHERE item = ? AND stage = ?", (item, stage)
+                )
+            else:
+                self.connection.execute("DELETE FROM stages WHERE item = ?", (item,))
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
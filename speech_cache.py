@@ -0,0 +1,99 @@
+import hashlib
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+
+from metrics import metrics
+
+
+class SpeechCache:
+    def __init__(
+        self,
+        cache_path: str = None,
+        max_memory_mb: float = 32,
+        max_characters: int = 100,
+    ):
+        # cache_path holds the disk tier (None keeps phrases in memory only)
+        self.cache_path = cache_path
+        if cache_path and not os.path.exists(cache_path):
+            os.makedirs(cache_path)
+
+        self.max_bytes = int(max_memory_mb * 1024 * 1024)
+        self.max_characters = max_characters
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries: OrderedDict[str, bytes] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def normalize(self, text: str) -> str:
+        # Case and spacing don't change what Piper says, punctuation does
+        text = unicodedata.normalize("NFC", text)
+        return re.sub(r"\s+", " ", text).strip().casefold()
+
+    def is_cacheable(self, text: str) -> bool:
+        # Long replies are rarely repeated, keep the space for short phrases
+        return 0 < len(self.normalize(text)) <= self.max_characters
+
+    def get_key(self, voice: str, text: str) -> str:
+        return hashlib.sha256(
+            f"{voice}\0{self.normalize(text)}".encode("utf-8")
+        ).hexdigest()
+
+    def get_file(self, key: str) -> str:
+        return os.path.join(self.cache_path, f"{key}.pcm")
+
+    def get(self, voice: str, text: str) -> Optional[bytes]:
+        if not self.is_cacheable(text):
+            return None
+        key = self.get_key(voice, text)
+        with self.lock:
+            pcm = self.entries.get(key)
+            if pcm is not None:
+                self.entries.move_to_end(key)
+        if pcm is None and self.cache_path and os.path.exists(self.get_file(key)):
+            with open(self.get_file(key), "rb") as f:
+                pcm = f.read()
+            self.__add(key, pcm)
+        with self.lock:
+            if pcm is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        metrics.increment("speech_cache_misses" if pcm is None else "speech_cache_hits")
+        return pcm
+
+    def put(self, voice: str, text: str, pcm: bytes):
+        if not pcm or not self.is_cacheable(text):
+            return
+        key = self.get_key(voice, text)
+        self.__add(key, pcm)
+        if self.cache_path and not os.path.exists(self.get_file(key)):
+            temp_file = f"{self.get_file(key)}.tmp"
+            with open(temp_file, "wb") as f:
+                f.write(pcm)
+            os.replace(temp_file, self.get_file(key))
+
+    def __add(self, key: str, pcm: bytes):
+        if len(pcm) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key))
+            self.entries[key] = pcm
+            self.size += len(pcm)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
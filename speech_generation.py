@@ -1,9 +1,10 @@
 import os
-import time
-import wave
-from piper.voice import PiperVoice
-import simpleaudio as sa
-from playsound import playsound
+import queue
+import threading
+from typing import Callable, List
+
+from model_registry import model_registry
+from speech_cache import SpeechCache
 
 
 class SpeechGeneration:
@@ -11,19 +12,90 @@ class SpeechGeneration:
         self,
         models_path: str = "models",
         model_name: str = "es_MX-claude-14947-epoch-high.onnx",
+        speech_cache: SpeechCache = None,
     ):
-        self.voice = PiperVoice.load(os.path.join(models_path, model_name))
-
-    def generate_speech(self, text: str):
-        try:
-            temp_file = os.path.abspath(f"{time.time()}.wav")
-            wav_file = wave.open(temp_file, "w")
-            self.voice.synthesize(text, wav_file)
-            wav_file.close()
-            playsound(temp_file)
-            # wave_obj = sa.WaveObject.from_wave_file(temp_file)
-            # play_obj = wave_obj.play()
-            # play_obj.wait_done()
-            os.remove(temp_file)
-        except Exception as e:
-            print(f"Error: {e}")
+        model_path = os.path.join(models_path, model_name)
+        self.voice = model_registry.get(
+            f"piper:{model_name}",
+            lambda: self.__load_voice(model_path),
+        )
+        self.sample_rate = self.voice.config.sample_rate
+        self.speech_cache = speech_cache
+        # Cached audio of a retrained model with the same name isn't reused
+        self.voice_id = f"{model_name}:{os.path.getmtime(model_path):.0f}"
+
+        import sounddevice as sd
+
+        # One output stream for the whole session, fed with Piper's 16-bit
+        # mono PCM straight from memory
+        self.output_stream = sd.RawOutputStream(
+            samplerate=self.sample_rate, channels=1, dtype="int16"
+        )
+        self.output_stream.start()
+
+        # Synthesis of the next utterance overlaps playback of the current one
+        self.text_queue = queue.Queue()
+        self.audio_queue = queue.Queue()
+        threading.Thread(target=self.__synthesize_worker, daemon=True).start()
+        threading.Thread(target=self.__playback_worker, daemon=True).start()
+
+    def __load_voice(self, model_path: str):
+        from piper.voice import PiperVoice
+
+        return PiperVoice.load(model_path)
+
+    def __synthesize_worker(self):
+        while True:
+            text, on_playback_start, play = self.text_queue.get()
+            try:
+                pcm = self.speech_cache and self.speech_cache.get(self.voice_id, text)
+                if pcm:
+                    if play:
+                        self.audio_queue.put((pcm, on_playback_start))
+                    continue
+                audio_chunks = []
+                for audio_chunk in self.voice.synthesize_stream_raw(text):
+                    audio_chunks.append(audio_chunk)
+                    if play:
+                        self.audio_queue.put((audio_chunk, on_playback_start))
+                        on_playback_start = None
+                if self.speech_cache:
+                    self.speech_cache.put(self.voice_id, text, b"".join(audio_chunks))
+            except Exception as e:
+                print(f"Error: {e}")
+            finally:
+                self.text_queue.task_done()
+
+    def __playback_worker(self):
+        while True:
+            audio_chunk, on_playback_start = self.audio_queue.get()
+            try:
+                if on_playback_start:
+                    on_playback_start()
+                self.output_stream.write(audio_chunk)
+            except Exception as e:
+                print(f"Error: {e}")
+            finally:
+                self.audio_queue.task_done()
+
+    def speak_async(self, text: str, on_playback_start: Callable[[], None] = None):
+        self.text_queue.put((text, on_playback_start, True))
+
+    def prewarm(self, phrases: List[str]):
+        # Synthesized into the cache ahead of the utterances queued after them
+        if not self.speech_cache:
+            return
+        for phrase in phrases:
+            self.text_queue.put((phrase, None, False))
+
+    def wait(self):
+        import sounddevice as sd
+
+        self.text_queue.join()
+        self.audio_queue.join()
+        # Let the device drain what is still buffered in the output stream
+        sd.sleep(int(self.output_stream.latency * 1000))
+
+    def generate_speech(self, text: str, on_playback_start: Callable[[], None] = None):
+        self.speak_async(text, on_playback_start)
+        self.wait()
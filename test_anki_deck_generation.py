@@ -0,0 +1,105 @@
+import os
+
+from anki_deck_generation import AnkiDeckGeneration
+from corpus_store import CorpusStore
+from pipeline_manifest import PipelineManifest
+
+CLIPS = {
+    "vidA": [
+        (
+            "[00000].SPEAKER_00.[00001.002]",
+            "Tengo hambre.",
+            "I am hungry.",
+            "tengo:I have\ntener:to have\n---",
+        ),
+        ("[00001].SPEAKER_01.[00004.001]", "no no no", None, None),
+        (
+            "[00002].SPEAKER_00.[00006.003]",
+            "Tienes razón.",
+            "You are right.",
+            "tienes:you have\ntener:to have\n---",
+        ),
+    ],
+    "vid[B]": [
+        (
+            "[00000].SPEAKER_00.[00002.002]",
+            "Es tarde.",
+            "It is late.",
+            "es:it is\nser:to be\n---",
+        ),
+    ],
+}
+
+
+def write_corpus(text_path: str, corpus_store: CorpusStore):
+    for video, clips in CLIPS.items():
+        os.makedirs(os.path.join(text_path, video))
+        for clip_name, transcript, translation, translated_verbs in clips:
+            outputs = {
+                "": transcript,
+                "-translated": translation,
+                "-translated_verbs": translated_verbs,
+            }
+            for suffix, text in outputs.items():
+                if text is not None:
+                    with open(
+                        os.path.join(text_path, video, f"{clip_name}{suffix}.txt"),
+                        "w",
+                        encoding="utf-8",
+                    ) as f:
+                        f.write(text)
+            corpus_store.put_segment(
+                video,
+                clip_name,
+                transcript=transcript,
+                translation=translation,
+                translated_verbs=translated_verbs,
+            )
+
+
+def test_file_and_store_decks_match(tmp_path):
+    text_path = str(tmp_path / "text")
+    corpus_store = CorpusStore(os.path.join(str(tmp_path), "corpus.sqlite"))
+    write_corpus(text_path, corpus_store)
+
+    for video in CLIPS:
+        file_content = AnkiDeckGeneration(video, text_path).get_deck_content()
+        store_content = AnkiDeckGeneration(
+            video, text_path, corpus_store
+        ).get_deck_content()
+        assert file_content == store_content
+        assert {card["video"] for card in file_content} == {video}
+
+    content = AnkiDeckGeneration("vidA", text_path).get_deck_content()
+    assert [(card["infinitive_es"], card["example_es"]) for card in content] == [
+        ("tener", "Tengo hambre.")
+    ]
+    corpus_store.close()
+
+
+def test_new_video_leaves_other_decks_unchanged(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    text_path = str(tmp_path / "text")
+    write_corpus(text_path, CorpusStore(str(tmp_path / "corpus.sqlite")))
+    manifest = PipelineManifest(str(tmp_path / "manifest.sqlite"))
+
+    anki_deck_generation = AnkiDeckGeneration("vidA", text_path, manifest=manifest)
+    content = anki_deck_generation.get_deck_content()
+    content_hash = anki_deck_generation.get_content_hash(content)
+    assert anki_deck_generation.generate_deck(content, delta=True) == 1
+
+    # A whole new video, whose verbs the old glob put into every deck
+    for suffix, text in {
+        "": "Quiero comer.",
+        "-translated": "I want to eat.",
+        "-translated_verbs": "quiero:I want\nquerer:to want\n---",
+    }.items():
+        clip_file = (
+            tmp_path / "text" / "vidC" / f"[00000].SPEAKER_00.[00001.001]{suffix}.txt"
+        )
+        clip_file.parent.mkdir(exist_ok=True)
+        clip_file.write_text(text, encoding="utf-8")
+    content = anki_deck_generation.get_deck_content()
+    assert anki_deck_generation.get_content_hash(content) == content_hash
+    assert anki_deck_generation.generate_deck(content, delta=True) == 0
+    assert sorted(path.name for path in tmp_path.glob("*.apkg")) == ["vidA.apkg"]
@@ -0,0 +1,73 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from llm_client import LLMClient
+
+
+def get_client(create, acreate=None) -> LLMClient:
+    client = LLMClient(
+        "http://a/v1",
+        "sk-test",
+        endpoints=[
+            {"url": "http://a/v1", "max_in_flight": 2},
+            {"url": "http://b/v1", "max_in_flight": 1},
+        ],
+    )
+    for endpoint in client.endpoints:
+        endpoint.client = SimpleNamespace(
+            chat=SimpleNamespace(completions=SimpleNamespace(create=create))
+        )
+        endpoint.async_client = SimpleNamespace(
+            chat=SimpleNamespace(completions=SimpleNamespace(create=acreate))
+        )
+    return client
+
+
+def get_in_flight(client: LLMClient):
+    return [endpoint.in_flight for endpoint in client.endpoints]
+
+
+def test_create_releases_endpoint_on_error():
+    def create(**options):
+        raise ValueError("bad response")
+
+    client = get_client(create)
+    # More failures than the endpoints have slots
+    for _ in range(5):
+        with pytest.raises(ValueError):
+            client.create(model="m", messages=[])
+    assert get_in_flight(client) == [0, 0]
+    assert all(endpoint.unhealthy_until == 0 for endpoint in client.endpoints)
+
+
+def test_acreate_releases_endpoint_on_error_and_cancellation():
+    async def acreate(**options):
+        if options.get("model") == "slow":
+            await asyncio.sleep(60)
+        raise ValueError("bad response")
+
+    client = get_client(None, acreate)
+
+    async def run():
+        for _ in range(5):
+            with pytest.raises(ValueError):
+                await client.acreate(model="m", messages=[])
+        for _ in range(5):
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(client.acreate(model="slow", messages=[]), 0.01)
+
+    asyncio.run(run())
+    assert get_in_flight(client) == [0, 0]
+
+
+def test_stream_releases_endpoint_on_error():
+    def create(**options):
+        raise ValueError("bad request")
+
+    client = get_client(create)
+    for _ in range(5):
+        with pytest.raises(ValueError):
+            list(client.stream("m", []))
+    assert get_in_flight(client) == [0, 0]
@@ -0,0 +1,82 @@
+import numpy as np
+
+from video_transcription import SAMPLE_RATE, VideoTranscription
+
+
+class StubDiarization(VideoTranscription):
+    def __init__(self, speech, tmp_path, **options):
+        super().__init__(
+            "",
+            output_audio_path=str(tmp_path / "audio"),
+            output_text_path=str(tmp_path / "text"),
+            temp_path=str(tmp_path / "temp"),
+            **options,
+        )
+        # (start, end, speaker) over the whole file, in seconds
+        self.speech = speech
+        self.window_starts = []
+
+    def diarize(self, audio):
+        self.audio = audio
+        return super().diarize(audio)
+
+    def diarize_window(self, samples):
+        # Recover the window's offset from the marker samples
+        offset = float(samples[0]) / SAMPLE_RATE
+        self.window_starts.append(offset)
+        duration = len(samples) / SAMPLE_RATE
+        return [
+            (max(start - offset, 0.0), min(end - offset, duration), f"W{speaker}")
+            for start, end, speaker in self.speech
+            if start < offset + duration and end > offset
+        ]
+
+
+def get_audio(seconds: float) -> np.ndarray:
+    # Each sample holds its own index, so a window knows where it starts
+    return np.arange(int(seconds * SAMPLE_RATE), dtype=np.float64)
+
+
+def get_speech_seconds(turns) -> float:
+    return sum(end - start for start, end, _ in turns)
+
+
+def test_diarize_keeps_turns_crossing_windows(tmp_path):
+    transcription = StubDiarization(
+        [(0.0, 200.0, 0)],
+        tmp_path,
+        diarization_window=60,
+        diarization_overlap=30,
+    )
+    turns = list(transcription.diarize(get_audio(200)))
+
+    assert len(transcription.window_starts) > 1
+    assert turns[0][0] == 0.0
+    assert turns[-1][1] == 200.0
+    assert get_speech_seconds(turns) == 200.0
+    # Contiguous pieces of the one turn, under one label
+    for (_, end, _), (start, _, _) in zip(turns, turns[1:]):
+        assert end == start
+    assert {speaker for _, _, speaker in turns} == {"SPEAKER_00"}
+
+
+def test_diarize_matches_speakers_across_windows(tmp_path):
+    speech = [
+        (start, start + 9.0, index % 2) for index, start in enumerate(range(0, 200, 10))
+    ]
+    transcription = StubDiarization(
+        speech, tmp_path, diarization_window=60, diarization_overlap=30
+    )
+    turns = list(transcription.diarize(get_audio(200)))
+
+    assert get_speech_seconds(turns) == get_speech_seconds(speech)
+    labels = {}
+    for start, end, speaker in turns:
+        original = next(s for s in speech if s[0] <= start and end <= s[1])[2]
+        assert labels.setdefault(original, speaker) == speaker
+    assert len(labels) == 2 and len(set(labels.values())) == 2
+
+
+def test_diarize_without_window(tmp_path):
+    transcription = StubDiarization([(5.0, 50.0, 0)], tmp_path)
+    assert list(transcription.diarize(get_audio(200))) == [(5.0, 50.0, "W0")]
@@ -0,0 +1,140 @@
+import os
+import platform
+from importlib.util import find_spec
+from typing import Union
+
+import numpy as np
+
+# Backend name -> module it needs
+BACKEND_MODULES = {
+    "mlx": "mlx_whisper",
+    "faster": "faster_whisper",
+    "openai": "whisper",
+}
+
+
+def get_default_device() -> str:
+    try:
+        import torch
+    except ImportError:
+        return "cpu"
+    if torch.cuda.is_available():
+        return "cuda"
+    if torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+def resolve_backend(backend: str = "auto", device: str = "cpu") -> str:
+    if backend != "auto":
+        if not find_spec(BACKEND_MODULES[backend]):
+            raise RuntimeError(
+                f"Transcription backend {backend} needs {BACKEND_MODULES[backend]}"
+            )
+        return backend
+    # mlx only runs on Apple silicon, CTranslate2 int8 is the fastest on CPU
+    # and CUDA, openai-whisper runs anywhere torch does
+    candidates = ["faster", "openai"]
+    if platform.system() == "Darwin" and platform.machine() == "arm64":
+        candidates.insert(0, "mlx")
+    elif device == "mps":
+        candidates = ["openai"]
+    for candidate in candidates:
+        if find_spec(BACKEND_MODULES[candidate]):
+            return candidate
+    raise RuntimeError(
+        "No transcription backend installed, install one of "
+        + ", ".join(BACKEND_MODULES.values())
+    )
+
+
+class MLXWhisperBackend:
+    def __init__(
+        self,
+        model: str,
+        device: str = None,
+        threads: int = 0,
+        compute_type: str = None,
+    ):
+        import mlx.core as mx
+        from huggingface_hub import snapshot_download
+        from mlx_whisper.transcribe import ModelHolder
+
+        # Resolve the repository to a local snapshot once and warm mlx_whisper's
+        # model holder, instead of resolving path_or_hf_repo on every call
+        self.model_path = (
+            model if os.path.exists(model) else snapshot_download(repo_id=model)
+        )
+        ModelHolder.get_model(self.model_path, mx.float16)
+
+    def transcribe(self, audio: Union[str, np.ndarray], **options) -> dict:
+        import mlx_whisper
+
+        return mlx_whisper.transcribe(audio, path_or_hf_repo=self.model_path, **options)
+
+
+class OpenAIWhisperBackend:
+    def __init__(
+        self,
+        model: str,
+        device: str = "cpu",
+        threads: int = 0,
+        compute_type: str = None,
+    ):
+        import torch
+        import whisper
+
+        if threads:
+            torch.set_num_threads(threads)
+        # Sparse ops used by the word timestamp alignment aren't on mps
+        self.device = "cpu" if device == "mps" else device
+        self.model = whisper.load_model(model, device=self.device)
+
+    def transcribe(self, audio: Union[str, np.ndarray], **options) -> dict:
+        return self.model.transcribe(audio, fp16=self.device == "cuda", **options)
+
+
+class FasterWhisperBackend:
+    def __init__(
+        self,
+        model: str,
+        device: str = "cpu",
+        threads: int = 0,
+        compute_type: str = "int8",
+    ):
+        from faster_whisper import WhisperModel
+
+        self.model = WhisperModel(
+            model,
+            device="cuda" if device == "cuda" else "cpu",
+            compute_type=compute_type,
+            cpu_threads=threads,
+        )
+
+    def transcribe(self, audio: Union[str, np.ndarray], **options) -> dict:
+        # Same shape as the whisper and mlx_whisper results
+        segments, _ = self.model.transcribe(audio, **options)
+        result_segments = []
+        for segment in segments:
+            result_segments.append(
+                {
+                    "start": segment.start,
+                    "end": segment.end,
+                    "text": segment.text,
+                    "words": [
+                        {"word": word.word, "start": word.start, "end": word.end}
+                        for word in segment.words or []
+                    ],
+                }
+            )
+        return {
+            "text": "".join(segment["text"] for segment in result_segments),
+            "segments": result_segments,
+        }
+
+
+BACKENDS = {
+    "mlx": MLXWhisperBackend,
+    "faster": FasterWhisperBackend,
+    "openai": OpenAIWhisperBackend,
+}
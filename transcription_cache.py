@@ -0,0 +1,108 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class TranscriptionCache:
+    def __init__(self, cache_path: str = "cache/transcription"):
+        self.diarization_path = os.path.join(cache_path, "diarization")
+        if not os.path.exists(self.diarization_path):
+            os.makedirs(self.diarization_path)
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            os.path.join(cache_path, "transcripts.sqlite"), check_same_thread=False
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS transcripts (
+                segment_hash TEXT NOT NULL,
+                model TEXT NOT NULL,
+                transcript TEXT NOT NULL,
+                created REAL NOT NULL,
+                PRIMARY KEY (segment_hash, model)
+            )""")
+        self.connection.commit()
+
+    def get_hash_from_string(self, string: str) -> str:
+        return hashlib.sha256(string.encode("utf-8")).hexdigest()
+
+    def get_segment_hash(self, segment_audio: np.ndarray) -> str:
+        return hashlib.sha256(
+            np.ascontiguousarray(segment_audio, dtype=np.float32).tobytes()
+        ).hexdigest()
+
+    def get_rttm_path(self, audio_hash: str, pipeline: str) -> str:
+        return os.path.join(
+            self.diarization_path,
+            f"{audio_hash}.{self.get_hash_from_string(pipeline)[:16]}.rttm",
+        )
+
+    def get_diarization(
+        self, audio_hash: str, pipeline: str
+    ) -> Optional[List[Tuple[float, float, str]]]:
+        rttm_path = self.get_rttm_path(audio_hash, pipeline)
+        if not os.path.exists(rttm_path):
+            return None
+        turns = []
+        with open(rttm_path, "r", encoding="utf-8") as f:
+            for line in f:
+                # SPEAKER <file> <channel> <onset> <duration> <NA> <NA> <speaker> <NA> <NA>
+                fields = line.split()
+                if len(fields) < 8 or fields[0] != "SPEAKER":
+                    continue
+                start = float(fields[3])
+                turns.append((start, round(start + float(fields[4]), 3), fields[7]))
+        return turns
+
+    def put_diarization(
+        self,
+        audio_hash: str,
+        pipeline: str,
+        turns: List[Tuple[float, float, str]],
+    ):
+        rttm_path = self.get_rttm_path(audio_hash, pipeline)
+        temp_file = f"{rttm_path}.tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            for start, end, speaker in turns:
+                f.write(
+                    f"SPEAKER {audio_hash} 1 {start:.3f} {end - start:.3f} "
+                    f"<NA> <NA> {speaker} <NA> <NA>\n"
+                )
+        os.replace(temp_file, rttm_path)
+
+    def get_transcripts(self, segment_hashes: List[str], model: str) -> Dict[str, str]:
+        transcripts = {}
+        with self.lock:
+            # Stay under SQLite's bound parameter limit
+            for start in range(0, len(segment_hashes), 500):
+                batch = segment_hashes[start : start + 500]
+                transcripts.update(
+                    self.connection.execute(
+                        f"""SELECT segment_hash, transcript FROM transcripts
+                        WHERE model = ? AND segment_hash IN ({", ".join("?" * len(batch))})""",
+                        [model, *batch],
+                    ).fetchall()
+                )
+        return transcripts
+
+    def put_transcripts(self, transcripts: Dict[str, str], model: str):
+        now = time.time()
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO transcripts VALUES (?, ?, ?, ?)",
+                [
+                    (segment_hash, model, transcript, now)
+                    for segment_hash, transcript in transcripts.items()
+                ],
+            )
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
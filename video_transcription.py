@@ -1,12 +1,38 @@
+import hashlib
 import os
+import subprocess
+import time
+import wave
 from pathlib import Path
-from typing import Tuple, Iterable
-import torch
-from pyannote.core import Annotation
-from pyannote.audio import Pipeline
-from moviepy import VideoFileClip
+from typing import Dict, List, Optional, Tuple, Iterable, Union
+import numpy as np
 from pydub import AudioSegment
-import mlx_whisper
+
+from corpus_store import CorpusStore
+from metrics import metrics
+from model_registry import model_registry
+from transcription_backends import BACKENDS
+from transcription_cache import TranscriptionCache
+
+SAMPLE_RATE = 16000
+AUDIO_FORMATS = {
+    # extension, ffmpeg muxer, ffmpeg codec
+    "wav": ("wav", "wav", "pcm_s16le"),
+    # Headerless float32 samples that load_audio memory-maps without decoding
+    "raw": ("f32", "f32le", "pcm_f32le"),
+}
+
+
+def decode_audio(audio_path: str) -> np.ndarray:
+    # Any format or layout ffmpeg reads, as 16 kHz mono float32
+    sound: AudioSegment = (
+        AudioSegment.from_file(audio_path)
+        .set_channels(1)
+        .set_frame_rate(SAMPLE_RATE)
+        .set_sample_width(2)
+    )
+    samples = np.frombuffer(sound.raw_data, dtype=np.int16)
+    return samples.astype(np.float32) / 32768.0
 
 
 class VideoTranscription:
@@ -18,18 +44,43 @@ class VideoTranscription:
         temp_path="temp",
         whisper_model="mlx-community/whisper-large-v3-turbo",
         device: str = None,
+        write_segments: bool = False,
+        audio_format: str = "wav",
+        corpus_store: CorpusStore = None,
+        whisper_backend: str = "mlx",
+        threads: int = 0,
+        compute_type: str = "int8",
+        diarization_window: float = 0,
+        diarization_overlap: float = 30,
+        result_cache_path: str = None,
+        merge_gap: float = 0,
+        min_duration: float = 0,
+        max_duration: float = 0,
+        energy_threshold: float = 0,
+        min_speech_ratio: float = 0.2,
     ):
-        self.pipeline = Pipeline.from_pretrained(
-            "pyannote/speaker-diarization",
-            use_auth_token=pyannote_token,
-        )
-        if device:
-            self.pipeline.to(torch.device(device))
-
+        self.pyannote_token = pyannote_token
+        self.device = device
         self.output_audio_path = output_audio_path
         self.output_text_path = output_text_path
         self.temp_path = temp_path
         self.whisper_model = whisper_model
+        self.write_segments = write_segments
+        self.audio_format = audio_format
+        self.corpus_store = corpus_store
+        self.whisper_backend = whisper_backend
+        self.threads = threads
+        self.compute_type = compute_type
+        self.diarization_window = diarization_window
+        self.diarization_overlap = diarization_overlap
+        self.merge_gap = merge_gap
+        self.min_duration = min_duration
+        self.max_duration = max_duration
+        self.energy_threshold = energy_threshold
+        self.min_speech_ratio = min_speech_ratio
+        self.transcription_cache = (
+            TranscriptionCache(result_cache_path) if result_cache_path else None
+        )
 
         if not os.path.exists(output_audio_path):
             os.makedirs(output_audio_path)
@@ -38,64 +89,591 @@ class VideoTranscription:
         if not os.path.exists(temp_path):
             os.makedirs(temp_path)
 
-    def extract_audio(self, video_path: str):
-        path = Path(video_path)
-        mp3_file = os.path.join(self.temp_path, f"{path.stem}.mp3")
-        wav_file = os.path.join(self.output_audio_path, f"{path.stem}.wav")
-        video_clip = VideoFileClip(video_path)
-        audio_clip = video_clip.audio
-        audio_clip.write_audiofile(mp3_file)
-        audio_clip.close()
-        video_clip.close()
-        sound: AudioSegment = AudioSegment.from_mp3(mp3_file)
-        sound.export(wav_file, format="wav")
-        os.remove(mp3_file)
+    def __load_pipeline(self):
+        import torch
+        from pyannote.audio import Pipeline
 
-    def transcribe_sentence(
-        self, temp_sentence_audio: str, clip_path: str = None, clip_name: str = None
-    ) -> Tuple[str, str]:
-        result = mlx_whisper.transcribe(
-            temp_sentence_audio,
-            path_or_hf_repo=self.whisper_model,
+        if self.threads:
+            torch.set_num_threads(self.threads)
+        pipeline = Pipeline.from_pretrained(
+            "pyannote/speaker-diarization",
+            use_auth_token=self.pyannote_token,
         )
-        clip_text = result["text"] if "text" in result else ""
+        if self.device:
+            pipeline.to(torch.device(self.device))
+        return pipeline
+
+    @property
+    def pipeline(self):
+        return model_registry.get(
+            f"pyannote/speaker-diarization:{self.device}", self.__load_pipeline
+        )
+
+    def __load_transcription_backend(self):
+        return BACKENDS[self.whisper_backend](
+            self.whisper_model, self.device, self.threads, self.compute_type
+        )
+
+    @property
+    def transcription_backend(self):
+        return model_registry.get(
+            f"{self.whisper_backend}:{self.whisper_model}:{self.device}",
+            self.__load_transcription_backend,
+        )
+
+    def get_file_hash(self, file_path: str, chunk_size: int = 1 << 20) -> str:
+        m = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            while chunk := f.read(chunk_size):
+                m.update(chunk)
+        return m.hexdigest()
+
+    def get_audio_path(self, video_path: str, audio_format: str = None) -> str:
+        extension = AUDIO_FORMATS[audio_format or self.audio_format][0]
+        return os.path.join(
+            self.output_audio_path, f"{Path(video_path).stem}.{extension}"
+        )
+
+    def extract_audio(
+        self, video_path: str, audio_format: str = None, video_hash: str = None
+    ) -> str:
+        audio_format = audio_format or self.audio_format
+        extension, muxer, codec = AUDIO_FORMATS[audio_format]
+        path = Path(video_path)
+        audio_file = self.get_audio_path(video_path, audio_format)
+        hash_file = f"{audio_file}.sha256"
+
+        video_hash = video_hash or self.get_file_hash(video_path)
+        if os.path.exists(audio_file) and os.path.exists(hash_file):
+            with open(hash_file, "r", encoding="utf-8") as f:
+                if f.read().strip() == video_hash:
+                    return audio_file
+
+        from moviepy.config import FFMPEG_BINARY
+
+        # Decode the audio track once, straight to the 16 kHz mono PCM that
+        # pyannote and whisper consume.
+        temp_file = os.path.join(self.temp_path, f"{path.stem}.{extension}")
+        with metrics.timer("extract_audio"):
+            subprocess.run(
+                [
+                    FFMPEG_BINARY,
+                    "-nostdin",
+                    "-loglevel",
+                    "error",
+                    "-y",
+                    "-i",
+                    video_path,
+                    "-vn",
+                    "-ac",
+                    "1",
+                    "-ar",
+                    str(SAMPLE_RATE),
+                    "-acodec",
+                    codec,
+                    "-f",
+                    muxer,
+                    temp_file,
+                ],
+                check=True,
+            )
+        os.replace(temp_file, audio_file)
+        with open(hash_file, "w", encoding="utf-8") as f:
+            f.write(video_hash)
+        return audio_file
+
+    def load_audio(self, audio_path: str) -> np.ndarray:
+        if audio_path.endswith(f".{AUDIO_FORMATS['raw'][0]}"):
+            # Copy-on-write so torch accepts the buffer without copying it
+            return np.memmap(audio_path, dtype=np.float32, mode="c")
+
+        if audio_path.endswith(".wav"):
+            with wave.open(audio_path, "rb") as wav_file:
+                if (
+                    wav_file.getnchannels() == 1
+                    and wav_file.getframerate() == SAMPLE_RATE
+                    and wav_file.getsampwidth() == 2
+                ):
+                    samples = np.frombuffer(
+                        wav_file.readframes(wav_file.getnframes()), dtype=np.int16
+                    )
+                    return samples.astype(np.float32) / 32768.0
+
+        return decode_audio(audio_path)
+
+    def write_wav(self, wav_path: str, audio: np.ndarray):
+        with wave.open(wav_path, "wb") as wav_file:
+            wav_file.setnchannels(1)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(SAMPLE_RATE)
+            wav_file.writeframes(
+                (np.clip(audio, -1.0, 1.0) * 32767).astype(np.int16).tobytes()
+            )
+
+    def write_transcript(self, clip_text: str, clip_path: str, clip_name: str) -> str:
         output_text_path = os.path.join(
             self.output_text_path, clip_path, f"{clip_name}.txt"
         )
         if clip_path and clip_name:
+            if self.corpus_store:
+                self.corpus_store.put_segment(
+                    clip_path, clip_name, transcript=clip_text
+                )
+                return output_text_path
             with open(
                 output_text_path,
                 "w",
                 encoding="utf-8",
             ) as f:
                 f.write(clip_text)
-        return clip_text, output_text_path
+        return output_text_path
+
+    def read_transcript(self, clip_path: str, clip_name: str) -> Optional[str]:
+        if self.corpus_store:
+            segment = self.corpus_store.get_segment(clip_path, clip_name)
+            return segment and segment["transcript"]
+        output_text_path = os.path.join(
+            self.output_text_path, clip_path, f"{clip_name}.txt"
+        )
+        if not os.path.exists(output_text_path):
+            return None
+        with open(output_text_path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    def get_model_id(self) -> str:
+        return f"{self.whisper_backend}:{self.whisper_model}"
+
+    def get_pipeline_id(self) -> str:
+        # Windowing changes the turns, so it is part of the diarization key
+        return f"pyannote/speaker-diarization:{self.diarization_window}:{self.diarization_overlap}"
+
+    def get_segmentation_id(self) -> str:
+        return (
+            f"{self.merge_gap}:{self.min_duration}:{self.max_duration}:"
+            f"{self.energy_threshold}:{self.min_speech_ratio}"
+        )
+
+    def get_input_hash(self, audio_file: str) -> str:
+        # Manifest hash of a file's diarize and transcribe stages, so a new
+        # model, windowing or segmentation setting reruns them
+        m = hashlib.sha256()
+        m.update(self.get_file_hash(audio_file).encode("utf-8"))
+        for part in (
+            self.get_model_id(),
+            self.get_pipeline_id(),
+            self.get_segmentation_id(),
+        ):
+            m.update(f"\0{part}".encode("utf-8"))
+        return m.hexdigest()
+
+    def transcribe_sentence(
+        self,
+        sentence_audio: Union[str, np.ndarray],
+        clip_path: str = None,
+        clip_name: str = None,
+    ) -> Tuple[str, str]:
+        segment_hash = None
+        if self.transcription_cache and isinstance(sentence_audio, np.ndarray):
+            segment_hash = self.transcription_cache.get_segment_hash(sentence_audio)
+            cached = self.transcription_cache.get_transcripts(
+                [segment_hash], self.get_model_id()
+            )
+            if segment_hash in cached:
+                metrics.increment("transcript_cache_hits")
+                clip_text = cached[segment_hash]
+                return clip_text, self.write_transcript(clip_text, clip_path, clip_name)
+
+        transcription_backend = self.transcription_backend
+        with metrics.timer("transcribe"):
+            result = transcription_backend.transcribe(sentence_audio)
+        metrics.increment("segments_transcribed")
+        clip_text = result["text"] if "text" in result else ""
+        if segment_hash:
+            self.transcription_cache.put_transcripts(
+                {segment_hash: clip_text}, self.get_model_id()
+            )
+        return clip_text, self.write_transcript(clip_text, clip_path, clip_name)
+
+    def transcribe_packed(
+        self, segments_audio: List[np.ndarray], padding: float = 1.0
+    ) -> List[str]:
+        # Pack the segments into one buffer separated by silence, transcribe it
+        # in a single pass and map the word timestamps back onto the segments.
+        silence = np.zeros(int(padding * SAMPLE_RATE), dtype=np.float32)
+        buffers = []
+        offsets = []
+        position = 0
+        for sentence_audio in segments_audio:
+            buffers.extend([sentence_audio, silence])
+            offsets.append(
+                (position / SAMPLE_RATE, (position + len(sentence_audio)) / SAMPLE_RATE)
+            )
+            position += len(sentence_audio) + len(silence)
+
+        transcription_backend = self.transcription_backend
+        with metrics.timer("transcribe", segments=len(segments_audio)):
+            result = transcription_backend.transcribe(
+                np.concatenate(buffers),
+                word_timestamps=True,
+                condition_on_previous_text=False,
+            )
+        metrics.increment("segments_transcribed", len(segments_audio))
+
+        segment_words = [[] for _ in segments_audio]
+        starts = np.array([start for start, _ in offsets])
+        for segment in result.get("segments", []):
+            for word in segment.get("words", []):
+                middle = (word["start"] + word["end"]) / 2
+                index = max(int(np.searchsorted(starts, middle, side="right")) - 1, 0)
+                if middle <= offsets[index][1] + padding / 2:
+                    segment_words[index].append(word["word"])
+        return ["".join(words) for words in segment_words]
+
+    def transcribe_segments(
+        self,
+        batch: List[Tuple[np.ndarray, str, str]],
+        padding: float = 1.0,
+    ) -> List[Tuple[str, str]]:
+        # Segments transcribed before (same samples, same model) come from the
+        # cache, only the rest are sent to the model
+        clip_texts = [None] * len(batch)
+        segment_hashes = []
+        if self.transcription_cache:
+            segment_hashes = [
+                self.transcription_cache.get_segment_hash(sentence_audio)
+                for sentence_audio, _, _ in batch
+            ]
+            cached = self.transcription_cache.get_transcripts(
+                segment_hashes, self.get_model_id()
+            )
+            clip_texts = [cached.get(segment_hash) for segment_hash in segment_hashes]
+            metrics.increment("transcript_cache_hits", len(cached))
+
+        pending = [
+            index for index, clip_text in enumerate(clip_texts) if clip_text is None
+        ]
+        if pending:
+            for index, clip_text in zip(
+                pending,
+                self.transcribe_packed([batch[index][0] for index in pending], padding),
+            ):
+                clip_texts[index] = clip_text
+            if self.transcription_cache:
+                self.transcription_cache.put_transcripts(
+                    {segment_hashes[index]: clip_texts[index] for index in pending},
+                    self.get_model_id(),
+                )
+
+        if self.corpus_store:
+            self.corpus_store.put_segments(
+                {
+                    "video": clip_path,
+                    "clip_name": clip_name,
+                    "transcript": clip_text,
+                }
+                for clip_text, (_, clip_path, clip_name) in zip(clip_texts, batch)
+            )
+            return [
+                (
+                    clip_text,
+                    os.path.join(self.output_text_path, clip_path, f"{clip_name}.txt"),
+                )
+                for clip_text, (_, clip_path, clip_name) in zip(clip_texts, batch)
+            ]
+
+        return [
+            (clip_text, self.write_transcript(clip_text, clip_path, clip_name))
+            for clip_text, (_, clip_path, clip_name) in zip(clip_texts, batch)
+        ]
+
+    def open_audio(self, audio_path: str) -> np.ndarray:
+        # Memory-map the samples where the file allows it, so only the windows
+        # and turns in use are paged in. Copy-on-write so torch accepts them.
+        if audio_path.endswith(f".{AUDIO_FORMATS['raw'][0]}"):
+            return np.memmap(audio_path, dtype=np.float32, mode="c")
+        if audio_path.endswith(".wav"):
+            with open(audio_path, "rb") as f, wave.open(f) as wav_file:
+                if (
+                    wav_file.getnchannels() == 1
+                    and wav_file.getframerate() == SAMPLE_RATE
+                    and wav_file.getsampwidth() == 2
+                ):
+                    # wave stops reading at the start of the data chunk
+                    return np.memmap(
+                        audio_path,
+                        dtype=np.int16,
+                        mode="c",
+                        offset=f.tell(),
+                        shape=(wav_file.getnframes(),),
+                    )
+        return self.load_audio(audio_path)
+
+    def get_samples(self, audio: np.ndarray, start: int, end: int) -> np.ndarray:
+        samples = audio[start:end]
+        if samples.dtype == np.int16:
+            return samples.astype(np.float32) / 32768.0
+        return samples
+
+    def diarize_window(self, samples: np.ndarray) -> List[Tuple[float, float, str]]:
+        import torch
+
+        pipeline = self.pipeline
+        with metrics.timer("diarize", seconds=len(samples) / SAMPLE_RATE):
+            diarization = pipeline(
+                {
+                    "waveform": torch.from_numpy(samples).unsqueeze(0),
+                    "sample_rate": SAMPLE_RATE,
+                }
+            )
+        return [
+            (turn.start, turn.end, speaker)
+            for turn, _, speaker in diarization.itertracks(yield_label=True)
+        ]
+
+    def match_speakers(
+        self,
+        previous_turns: List[Tuple[float, float, str]],
+        turns: List[Tuple[float, float, str]],
+        overlap_start: float,
+        overlap_end: float,
+    ) -> Dict[str, str]:
+        # Pair each speaker of the new window with the speaker of the previous
+        # window it shares the most speech with inside the overlap
+        shared_speech = {}
+        for previous_start, previous_end, previous_speaker in previous_turns:
+            if previous_end <= overlap_start:
+                continue
+            for start, end, speaker in turns:
+                if start >= overlap_end:
+                    break
+                shared = min(previous_end, end, overlap_end) - max(
+                    previous_start, start, overlap_start
+                )
+                if shared > 0:
+                    key = (speaker, previous_speaker)
+                    shared_speech[key] = shared_speech.get(key, 0.0) + shared
+        labels = {}
+        for speaker, previous_speaker in sorted(
+            shared_speech, key=shared_speech.get, reverse=True
+        ):
+            if speaker not in labels and previous_speaker not in labels.values():
+                labels[speaker] = previous_speaker
+        return labels
 
-    def split_sentences(self, audio_path: str) -> Iterable[Tuple[str, str, str]]:
-        diarization: Annotation = self.pipeline(audio_path)
+    def diarize(self, audio: np.ndarray) -> Iterable[Tuple[float, float, str]]:
+        window = int(self.diarization_window * SAMPLE_RATE)
+        if not window or len(audio) <= window:
+            yield from self.diarize_window(self.get_samples(audio, 0, len(audio)))
+            return
+
+        # Overlapping windows, so labels can be carried across the boundary
+        # and turns yielded as soon as their window is done. Each window owns
+        # the time up to its overlaps' midpoints, turns crossing a midpoint are
+        # cut there and continued by the next window.
+        overlap = int(
+            min(self.diarization_overlap, self.diarization_window / 2) * SAMPLE_RATE
+        )
+        step = window - overlap
+        previous_turns = []
+        speaker_count = 0
+        window_start = 0
+        while True:
+            window_end = min(window_start + window, len(audio))
+            offset = window_start / SAMPLE_RATE
+            turns = [
+                (start + offset, end + offset, speaker)
+                for start, end, speaker in self.diarize_window(
+                    self.get_samples(audio, window_start, window_end)
+                )
+            ]
+            labels = self.match_speakers(
+                previous_turns, turns, offset, (window_start + overlap) / SAMPLE_RATE
+            )
+            for _, _, speaker in turns:
+                if speaker not in labels:
+                    labels[speaker] = f"SPEAKER_{speaker_count:02d}"
+                    speaker_count += 1
+            turns = [(start, end, labels[speaker]) for start, end, speaker in turns]
+
+            last_window = window_end >= len(audio)
+            owned_start = (
+                (window_start + overlap / 2) / SAMPLE_RATE if window_start else 0
+            )
+            owned_end = (
+                float("inf")
+                if last_window
+                else (window_start + step + overlap / 2) / SAMPLE_RATE
+            )
+            for start, end, speaker in turns:
+                start, end = max(start, owned_start), min(end, owned_end)
+                if end > start:
+                    yield start, end, speaker
+            if last_window:
+                return
+            previous_turns = turns
+            window_start += step
+
+    def get_turns(
+        self, audio: np.ndarray, audio_hash: str = None
+    ) -> Iterable[Tuple[float, float, str]]:
+        if not self.transcription_cache or not audio_hash:
+            yield from self.diarize(audio)
+            return
+        turns = self.transcription_cache.get_diarization(
+            audio_hash, self.get_pipeline_id()
+        )
+        if turns is not None:
+            metrics.increment("diarization_cache_hits")
+            yield from turns
+            return
+        turns = []
+        for start, end, speaker in self.diarize(audio):
+            # Rounded as stored, so a cached run cuts the same samples and its
+            # segments hit the transcript cache
+            turn = (round(start, 3), round(end, 3), speaker)
+            turns.append(turn)
+            yield turn
+        # Only stored once every window is done
+        self.transcription_cache.put_diarization(
+            audio_hash, self.get_pipeline_id(), turns
+        )
+
+    def split_turn(
+        self, start: float, end: float, speaker: str
+    ) -> Iterable[Tuple[float, float, str]]:
+        if not self.max_duration or end - start <= self.max_duration:
+            yield start, end, speaker
+            return
+        parts = int(np.ceil((end - start) / self.max_duration))
+        part_duration = (end - start) / parts
+        for part in range(parts):
+            yield start + part * part_duration, start + (
+                part + 1
+            ) * part_duration, speaker
+
+    def coalesce_turns(
+        self, turns: Iterable[Tuple[float, float, str]], stats: Dict[str, int]
+    ) -> Iterable[Tuple[float, float, str]]:
+        # Merge a speaker's consecutive turns separated by short pauses (as
+        # long as the result stays under max_duration), then split whatever is
+        # still too long
+        def split(turn: Tuple[float, float, str]) -> List[Tuple[float, float, str]]:
+            parts = list(self.split_turn(*turn))
+            stats["split"] += len(parts) - 1
+            return parts
+
+        current = None
+        for start, end, speaker in turns:
+            stats["turns"] += 1
+            if (
+                current
+                and speaker == current[2]
+                and start - current[1] <= self.merge_gap
+                and (not self.max_duration or end - current[0] <= self.max_duration)
+            ):
+                current = (current[0], max(current[1], end), speaker)
+                stats["merged"] += 1
+                continue
+            if current:
+                yield from split(current)
+            current = (start, end, speaker)
+        if current:
+            yield from split(current)
+
+    def get_speech_range(
+        self, samples: np.ndarray, frame_duration: float = 0.03, margin: float = 0.2
+    ) -> Optional[Tuple[int, int]]:
+        # Frame energies in one vectorized pass. None when too little of the
+        # segment is above the threshold (silence, music beds, noise), else
+        # the range from the first to the last speech frame plus a margin.
+        if not self.energy_threshold:
+            return 0, len(samples)
+        frame_size = int(frame_duration * SAMPLE_RATE)
+        frames = len(samples) // frame_size
+        if not frames:
+            return None
+        energy = np.sqrt(
+            np.mean(
+                np.square(samples[: frames * frame_size].reshape(frames, frame_size)),
+                axis=1,
+            )
+        )
+        speech = energy > self.energy_threshold
+        if speech.mean() < self.min_speech_ratio:
+            return None
+        speech_frames = np.flatnonzero(speech)
+        margin_samples = int(margin * SAMPLE_RATE)
+        return (
+            max(int(speech_frames[0]) * frame_size - margin_samples, 0),
+            min(
+                (int(speech_frames[-1]) + 1) * frame_size + margin_samples, len(samples)
+            ),
+        )
+
+    def split_sentences(
+        self, audio_path: str, write_segments: bool = None
+    ) -> Iterable[Tuple[np.ndarray, str, str]]:
+        if write_segments is None:
+            write_segments = self.write_segments
+
+        # Map (or decode) once, then hand out slices of the same buffer to the
+        # diarization pipeline and to every turn.
+        with metrics.timer("load_audio"):
+            audio = self.open_audio(audio_path)
+        audio_hash = self.transcription_cache and self.get_file_hash(audio_path)
         wav_path = Path(audio_path)
         clip_path = wav_path.stem
         text_directory = os.path.join(self.output_text_path, clip_path)
         if not os.path.exists(text_directory):
             os.makedirs(text_directory)
+        if write_segments and not os.path.exists(
+            os.path.join(self.temp_path, clip_path)
+        ):
+            os.makedirs(os.path.join(self.temp_path, clip_path))
         clip_number = 0
-        for turn, _, speaker in diarization.itertracks(yield_label=True):
-            clip_start = int(turn.start)
-            clip_end = int(turn.end)
+        stats = {"turns": 0, "merged": 0, "split": 0, "short": 0, "silent": 0}
+        for turn_start, turn_end, speaker in self.coalesce_turns(
+            self.get_turns(audio, audio_hash), stats
+        ):
+            slice_start_time = time.perf_counter()
+            start_sample = int(turn_start * SAMPLE_RATE)
+            sentence_audio = self.get_samples(
+                audio, start_sample, int(turn_end * SAMPLE_RATE)
+            )
+            speech_range = self.get_speech_range(sentence_audio)
+            if speech_range is None:
+                stats["silent"] += 1
+                continue
+            if speech_range[1] - speech_range[0] < self.min_duration * SAMPLE_RATE:
+                stats["short"] += 1
+                continue
+            sentence_audio = sentence_audio[speech_range[0] : speech_range[1]]
+            turn_start = (start_sample + speech_range[0]) / SAMPLE_RATE
+            turn_end = (start_sample + speech_range[1]) / SAMPLE_RATE
+
+            clip_start = int(turn_start)
+            clip_end = int(turn_end)
             clip_name = f"[{clip_number:05d}].{speaker}.[{clip_start:05d}.{clip_end-clip_start:03d}]"
             clip_number += 1
-            if not os.path.exists(os.path.join(self.temp_path, clip_path)):
-                os.makedirs(os.path.join(self.temp_path, clip_path))
-            temp_sentence_audio = os.path.join(
-                self.temp_path, clip_path, f"{clip_name}.wav"
-            )
-            sound: AudioSegment = AudioSegment.from_wav(audio_path)
-            start_seconds = turn.start * 1000
-            end_seconds = turn.end * 1000
-            sound[start_seconds:end_seconds].export(temp_sentence_audio, format="wav")
-            yield temp_sentence_audio, clip_path, clip_name
+            if write_segments:
+                self.write_wav(
+                    os.path.join(self.temp_path, clip_path, f"{clip_name}.wav"),
+                    sentence_audio,
+                )
+            metrics.record("slice", time.perf_counter() - slice_start_time)
+            yield sentence_audio, clip_path, clip_name
+
+        removed = stats["merged"] + stats["short"] + stats["silent"]
+        for name, value in stats.items():
+            metrics.increment(f"segmentation_{name}", value)
+        print(
+            f"{clip_path}: {stats['turns']} turns -> {clip_number} segments "
+            f"({removed} removed: {stats['merged']} merged, {stats['short']} too "
+            f"short, {stats['silent']} without speech; {stats['split']} added by "
+            "splitting long turns)"
+        )
 
     def transcribe_video(self, video_path: str):
-        self.extract_audio(video_path)
-        for temp_sentence_audio, clip_name in self.split_sentences(video_path):
-            self.transcribe_sentences(temp_sentence_audio, clip_name)
+        audio_path = self.extract_audio(video_path)
+        for sentence_audio, clip_path, clip_name in self.split_sentences(audio_path):
+            self.transcribe_sentence(sentence_audio, clip_path, clip_name)
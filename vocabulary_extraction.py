@@ -1,8 +1,36 @@
+import asyncio
 import glob
+import json
 import os
-from typing import Counter, Iterable, List
+from typing import Counter, Iterable, List, Optional
 
-from openai import OpenAI
+from corpus_store import FILE_SUFFIXES, CorpusStore
+from llm_cache import LLMCache
+from llm_client import LLMClient, parse_json_object, split_into_batches
+
+VOCABULARY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "translation": {"type": "string"},
+        "verbs": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "verb": {"type": "string"},
+                    "verb_en": {"type": "string"},
+                    "infinitive": {"type": "string"},
+                    "infinitive_en": {"type": "string"},
+                },
+                "required": ["verb", "verb_en", "infinitive", "infinitive_en"],
+                "additionalProperties": False,
+            },
+        },
+        "nouns": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["translation", "verbs", "nouns"],
+    "additionalProperties": False,
+}
 
 
 class VocabularyExtraction:
@@ -79,20 +107,64 @@ class VocabularyExtraction:
             },
         ]
 
+    def get_part_of_speech_batch_prompt(self, texts: List[str]):
+        return [
+            {
+                "role": "system",
+                "content": 'For each numbered sentence in the JSON object below, state the part of speach (POS) each word belongs to. Return only a JSON object that maps each sentence number to a list with one string per word, made of the word followed by a colon and the part of speach. For example, {"1": ["The: determiner", "dog: noun"]}. Don\'t comment on or annotate the answer in any other way.',
+            },
+            {
+                "role": "user",
+                "content": json.dumps(
+                    {str(number): text for number, text in enumerate(texts, 1)},
+                    ensure_ascii=False,
+                ),
+            },
+        ]
+
+    def get_vocabulary_prompt(self, text: str):
+        return [
+            {
+                "role": "system",
+                "content": "For the Spanish sentence below, return a JSON object with its English translation, the verbs it contains and its non-proper nouns. For each verb give the verb as it appears in the sentence, its English translation, its infinitive and the English translation of the infinitive (for example: Tienes, You have, tener, To have). If the Spanish verb indicates a pronoun include it in the non-infinitive translation. Use empty lists if there are no verbs or nouns. Don't comment on or annotate the answer in any other way.",
+            },
+            {
+                "role": "user",
+                "content": text,
+            },
+        ]
+
     def __init__(
         self,
         openai_url: str,
         openai_api_key: str,
         text_path: str,
         model: str = "llama-3.3-70b-instruct",
+        llm_cache: LLMCache = None,
+        batch_token_budget: int = 1500,
+        corpus_store: CorpusStore = None,
+        llm_client: LLMClient = None,
     ):
         self.openai_url = openai_url
         self.openai_api_key = openai_api_key
         self.text_path = text_path
         self.model = model
-        self.client = OpenAI(base_url=openai_url, api_key=openai_api_key)
+        self.client = llm_client or LLMClient(openai_url, openai_api_key, llm_cache)
+        self.batch_token_budget = batch_token_budget
+        self.corpus_store = corpus_store
 
     def get_sentences(self, glob_pattern: str = "./**/*].txt") -> List[str]:
+        if self.corpus_store:
+            return [
+                (
+                    os.path.join(
+                        self.text_path, segment["video"], f"{segment['clip_name']}.txt"
+                    ),
+                    segment["transcript"],
+                )
+                for segment in self.corpus_store.get_segments()
+                if segment["transcript"] is not None
+            ]
         sentences = []
         files = glob.glob(os.path.join(self.text_path, glob_pattern))
         for file in files:
@@ -101,52 +173,184 @@ class VocabularyExtraction:
                 sentences.append((file, sentence))
         return sentences
 
-    def tag_part_of_speech(self, text: str) -> Iterable[list[str]]:
-
+    def has_too_many_duplicates(self, text: str) -> bool:
         words = text.split()
-        if len(set(words)) < Counter(words).most_common(1)[0][1]:
+        if not words:
+            return True
+        return len(set(words)) < Counter(words).most_common(1)[0][1]
+
+    def __write_vocabulary(self, vocabulary: str, output_vocabulary_file) -> List[str]:
+        if output_vocabulary_file:
+            with open(output_vocabulary_file, "w") as f:
+                f.write(vocabulary)
+        return vocabulary.split("\n")
+
+    def tag_part_of_speech(self, text: str) -> Iterable[list[str]]:
+        if self.has_too_many_duplicates(text):
             # Skip if there are too many duplicate words (breaks the llm)
             yield None
+            return
 
-        vocab_pos_completion = self.client.chat.completions.create(
-            model=self.model,
-            messages=self.get_part_of_speech_prompt(text),
-            temperature=0.2,
-            timeout=800,
+        vocab_pos = self.client.complete(
+            self.model, self.get_part_of_speech_prompt(text), 0.2
         )
-        vocab_pos = vocab_pos_completion.choices[0].message.content
 
         yield vocab_pos.split("\n")
 
+    async def tag_part_of_speech_async(self, text: str) -> Optional[list[str]]:
+        if self.has_too_many_duplicates(text):
+            # Skip if there are too many duplicate words (breaks the llm)
+            return None
+
+        vocab_pos = await self.client.acomplete(
+            self.model, self.get_part_of_speech_prompt(text), 0.2
+        )
+        return vocab_pos.split("\n")
+
+    def __parse_part_of_speech_batch(
+        self, content: str, count: int
+    ) -> List[Optional[list[str]]]:
+        result = parse_json_object(content) or {}
+        tagged = []
+        for number in range(1, count + 1):
+            vocab_pos = result.get(str(number))
+            if isinstance(vocab_pos, str):
+                vocab_pos = vocab_pos.split("\n")
+            if not isinstance(vocab_pos, list) or not vocab_pos:
+                vocab_pos = None
+            tagged.append(vocab_pos and [str(line) for line in vocab_pos])
+        return tagged
+
+    async def tag_part_of_speech_batch_async(
+        self, texts: List[str]
+    ) -> List[Optional[list[str]]]:
+        tagged = [None] * len(texts)
+        indices = [
+            index
+            for index, text in enumerate(texts)
+            if not self.has_too_many_duplicates(text)
+        ]
+
+        async def tag_batch(batch: List[int]):
+            batch_texts = [texts[indices[index]] for index in batch]
+            content = await self.client.acomplete(
+                self.model, self.get_part_of_speech_batch_prompt(batch_texts), 0.2
+            )
+            results = self.__parse_part_of_speech_batch(content, len(batch))
+            for index, text, vocab_pos in zip(batch, batch_texts, results):
+                if vocab_pos is None:
+                    # Fall back to a single sentence prompt for anything the
+                    # batched answer didn't cover
+                    vocab_pos = await self.tag_part_of_speech_async(text)
+                tagged[indices[index]] = vocab_pos
+
+        await asyncio.gather(
+            *(
+                tag_batch(batch)
+                for batch in split_into_batches(
+                    [texts[index] for index in indices], self.batch_token_budget
+                )
+            )
+        )
+        return tagged
+
+    def __parse_vocabulary(self, content: str) -> Optional[dict]:
+        vocabulary = parse_json_object(content)
+        if not vocabulary or not isinstance(vocabulary.get("translation"), str):
+            return None
+        verbs = vocabulary.get("verbs")
+        nouns = vocabulary.get("nouns")
+        if not isinstance(verbs, list) or not isinstance(nouns, list):
+            return None
+        verb_fields = VOCABULARY_SCHEMA["properties"]["verbs"]["items"]["required"]
+        for verb in verbs:
+            if not isinstance(verb, dict) or not all(
+                isinstance(verb.get(field), str) and verb[field].strip()
+                for field in verb_fields
+            ):
+                return None
+        if not all(isinstance(noun, str) for noun in nouns):
+            return None
+        return vocabulary
+
+    def format_vocabulary(self, vocabulary: dict) -> dict:
+        # Same fields (and formats) that the prompt chain produces
+        verbs = [
+            f"{verb['verb'].strip()}:{verb['infinitive'].strip()}"
+            for verb in vocabulary["verbs"]
+        ]
+        translated_verbs = [
+            f"{verb['verb'].strip()}:{verb['verb_en'].strip()}\n"
+            f"{verb['infinitive'].strip()}:{verb['infinitive_en'].strip()}\n---"
+            for verb in vocabulary["verbs"]
+        ]
+        nouns = [noun.strip() for noun in vocabulary["nouns"] if noun.strip()]
+        return {
+            "verbs": "\n".join(verbs) or "-",
+            "nouns": "\n".join(nouns) or "-",
+            "translation": vocabulary["translation"].strip() or "-",
+            "translated_verbs": "\n".join(translated_verbs) or "-",
+        }
+
+    def write_vocabulary_files(self, vocabulary: dict, sentence_output_path: str):
+        for field, content in self.format_vocabulary(vocabulary).items():
+            with open(
+                sentence_output_path.replace(".txt", f"{FILE_SUFFIXES[field]}.txt"), "w"
+            ) as f:
+                f.write(content)
+
+    async def extract_vocabulary_async(
+        self, text: str, sentence_output_path: str = None
+    ) -> Optional[dict]:
+        content = await self.client.acomplete(
+            self.model,
+            self.get_vocabulary_prompt(text),
+            0.2,
+            response_format={
+                "type": "json_schema",
+                "json_schema": {
+                    "name": "vocabulary",
+                    "strict": True,
+                    "schema": VOCABULARY_SCHEMA,
+                },
+            },
+        )
+        vocabulary = self.__parse_vocabulary(content)
+        if vocabulary and sentence_output_path:
+            self.write_vocabulary_files(vocabulary, sentence_output_path)
+        return vocabulary
+
     def get_verbs(
         self, text: str, vocab_pos: list[str], output_vocabulary_file=None
     ) -> List[str]:
-        verbs_completion = self.client.chat.completions.create(
-            model=self.model,
-            messages=self.get_verbs_prompt(text, "\n".join(vocab_pos)),
-            temperature=0.2,
-            timeout=800,
+        verbs = self.client.complete(
+            self.model, self.get_verbs_prompt(text, "\n".join(vocab_pos)), 0.2
         )
-        verbs = verbs_completion.choices[0].message.content
-        if output_vocabulary_file:
-            with open(output_vocabulary_file, "w") as f:
-                f.write(verbs)
-        return verbs.split("\n")
+        return self.__write_vocabulary(verbs, output_vocabulary_file)
+
+    async def get_verbs_async(
+        self, text: str, vocab_pos: list[str], output_vocabulary_file=None
+    ) -> List[str]:
+        verbs = await self.client.acomplete(
+            self.model, self.get_verbs_prompt(text, "\n".join(vocab_pos)), 0.2
+        )
+        return self.__write_vocabulary(verbs, output_vocabulary_file)
 
     def get_nouns(
         self, text: str, vocab_pos: list[str], output_vocabulary_file=None
     ) -> List[str]:
-        nouns_completion = self.client.chat.completions.create(
-            model=self.model,
-            messages=self.get_nouns_prompt(text, "\n".join(vocab_pos)),
-            temperature=0.2,
-            timeout=800,
+        nouns = self.client.complete(
+            self.model, self.get_nouns_prompt(text, "\n".join(vocab_pos)), 0.2
         )
-        nouns = nouns_completion.choices[0].message.content
-        if output_vocabulary_file:
-            with open(output_vocabulary_file, "w") as f:
-                f.write(nouns)
-        return nouns.split("\n")
+        return self.__write_vocabulary(nouns, output_vocabulary_file)
+
+    async def get_nouns_async(
+        self, text: str, vocab_pos: list[str], output_vocabulary_file=None
+    ) -> List[str]:
+        nouns = await self.client.acomplete(
+            self.model, self.get_nouns_prompt(text, "\n".join(vocab_pos)), 0.2
+        )
+        return self.__write_vocabulary(nouns, output_vocabulary_file)
 
     def translate_nouns(self):
         texts = []
@@ -0,0 +1,235 @@
+import asyncio
+from pathlib import Path
+from typing import Iterable, List, Tuple
+
+from corpus_store import CorpusStore
+from pipeline_manifest import PipelineManifest
+from vocabulary_extraction import VocabularyExtraction
+from vocabulary_translation import VocabularyTranslation
+
+
+class VocabularyPipeline:
+    def __init__(
+        self,
+        vocabulary_extraction: VocabularyExtraction,
+        vocabulary_translation: VocabularyTranslation,
+        concurrency: int = 8,
+        batch_size: int = 1,
+        structured: bool = False,
+        manifest: PipelineManifest = None,
+        corpus_store: CorpusStore = None,
+    ):
+        self.vocabulary_extraction = vocabulary_extraction
+        self.vocabulary_translation = vocabulary_translation
+        self.concurrency = max(concurrency, 1)
+        self.batch_size = max(batch_size, 1)
+        self.structured = structured
+        self.manifest = manifest
+        self.corpus_store = corpus_store
+
+    def get_output_path(self, sentence_output_path: str, suffix: str) -> str:
+        # Results go to the corpus store instead of per-clip files when enabled
+        if self.corpus_store:
+            return None
+        return sentence_output_path.replace(".txt", f"{suffix}.txt")
+
+    def store_vocabulary(self, sentence_output_path: str, **fields: str):
+        if self.corpus_store:
+            self.corpus_store.put_segment(
+                *self.corpus_store.get_segment_key(sentence_output_path), **fields
+            )
+
+    def __get_sentence_hash(self, sentence_text: str) -> str:
+        return self.manifest.get_hash_from_string(
+            self.vocabulary_extraction.model,
+            "structured" if self.structured else "chain",
+            sentence_text,
+        )
+
+    def is_done(self, sentence_text: str, sentence_output_path: str) -> bool:
+        return bool(self.manifest) and self.manifest.are_done(
+            sentence_output_path,
+            ["pos", "verbs", "nouns", "translate"],
+            self.__get_sentence_hash(sentence_text),
+        )
+
+    def mark_done(self, sentence_text: str, sentence_output_path: str, *stages: str):
+        if not self.manifest:
+            return
+        sentence_hash = self.__get_sentence_hash(sentence_text)
+        for stage in stages:
+            self.manifest.mark_done(sentence_output_path, stage, sentence_hash)
+
+    async def extract_vocabulary(
+        self,
+        sentence_text: str,
+        sentence_output_path: str,
+        vocab_pos: list[str],
+        translated_sentence: str = None,
+    ):
+        extraction_tasks = [
+            self.vocabulary_extraction.get_verbs_async(
+                sentence_text,
+                vocab_pos,
+                self.get_output_path(sentence_output_path, "-verbs"),
+            ),
+            self.vocabulary_extraction.get_nouns_async(
+                sentence_text,
+                vocab_pos,
+                self.get_output_path(sentence_output_path, "-nouns"),
+            ),
+        ]
+        if translated_sentence is None:
+            extraction_tasks.append(
+                self.vocabulary_translation.translate_sentence_async(
+                    sentence_text,
+                    self.get_output_path(sentence_output_path, "-translated"),
+                )
+            )
+        verbs, nouns, *translation = await asyncio.gather(*extraction_tasks)
+        translated_sentence = translated_sentence or translation[0]
+        self.mark_done(sentence_text, sentence_output_path, "verbs", "nouns")
+
+        translated_verbs = await self.vocabulary_translation.translate_verbs_async(
+            sentence_text,
+            verbs,
+            self.get_output_path(sentence_output_path, "-translated_verbs"),
+            Path(sentence_output_path).parent.name,
+        )
+        self.store_vocabulary(
+            sentence_output_path,
+            pos="\n".join(vocab_pos),
+            verbs="\n".join(verbs),
+            nouns="\n".join(nouns),
+            translation=translated_sentence,
+            translated_verbs="\n".join(translated_verbs),
+        )
+        self.mark_done(sentence_text, sentence_output_path, "translate")
+        print(f"Translated sentence: {translated_sentence}")
+        print(f"Translated verbs: {translated_verbs}")
+
+    async def process_sentence(self, sentence_text: str, sentence_output_path: str):
+        if self.structured:
+            if self.vocabulary_extraction.has_too_many_duplicates(sentence_text):
+                return
+            vocabulary = await self.vocabulary_extraction.extract_vocabulary_async(
+                sentence_text, self.get_output_path(sentence_output_path, "")
+            )
+            if vocabulary:
+                self.store_vocabulary(
+                    sentence_output_path,
+                    **self.vocabulary_extraction.format_vocabulary(vocabulary),
+                )
+                self.mark_done(
+                    sentence_text,
+                    sentence_output_path,
+                    "pos",
+                    "verbs",
+                    "nouns",
+                    "translate",
+                )
+                print(f"Translated sentence: {vocabulary['translation']}")
+                print(f"Translated verbs: {vocabulary['verbs']}")
+                return
+            # Fall back to the prompt chain when the answer doesn't validate
+
+        vocab_pos = await self.vocabulary_extraction.tag_part_of_speech_async(
+            sentence_text
+        )
+        if not vocab_pos:
+            return
+        self.mark_done(sentence_text, sentence_output_path, "pos")
+        await self.extract_vocabulary(sentence_text, sentence_output_path, vocab_pos)
+
+    async def process_batch(self, sentences: List[Tuple[str, str]]):
+        # POS tagging and sentence translation are packed into multi-sentence
+        # prompts; the per-sentence calls then run concurrently.
+        sentences = [
+            (sentence_text, sentence_output_path)
+            for sentence_text, sentence_output_path in sentences
+            if not self.vocabulary_extraction.has_too_many_duplicates(sentence_text)
+        ]
+        if not sentences:
+            return
+        texts = [sentence_text for sentence_text, _ in sentences]
+        vocab_pos_batch, translated_batch = await asyncio.gather(
+            self.vocabulary_extraction.tag_part_of_speech_batch_async(texts),
+            self.vocabulary_translation.translate_sentences_batch_async(
+                texts,
+                [
+                    self.get_output_path(sentence_output_path, "-translated")
+                    for _, sentence_output_path in sentences
+                ],
+            ),
+        )
+        for (sentence_text, sentence_output_path), vocab_pos in zip(
+            sentences, vocab_pos_batch
+        ):
+            if vocab_pos:
+                self.mark_done(sentence_text, sentence_output_path, "pos")
+        await asyncio.gather(
+            *(
+                self.extract_vocabulary(
+                    sentence_text, sentence_output_path, vocab_pos, translated_sentence
+                )
+                for (
+                    sentence_text,
+                    sentence_output_path,
+                ), vocab_pos, translated_sentence in zip(
+                    sentences, vocab_pos_batch, translated_batch
+                )
+                if vocab_pos
+            )
+        )
+
+    async def __process_batch_bounded(
+        self,
+        semaphore: asyncio.Semaphore,
+        sentences: List[Tuple[str, str]],
+    ):
+        try:
+            if self.batch_size > 1 and not self.structured:
+                await self.process_batch(sentences)
+            else:
+                await asyncio.gather(
+                    *(self.process_sentence(*sentence) for sentence in sentences)
+                )
+        finally:
+            semaphore.release()
+
+    async def process_sentences(self, sentences: Iterable[Tuple[str, str]]):
+        # Up to concurrency batches in flight, each one prompt per stage when
+        # batching and one sentence otherwise
+        semaphore = asyncio.Semaphore(self.concurrency)
+        batch_size = (
+            self.batch_size if self.batch_size > 1 and not self.structured else 1
+        )
+        tasks = []
+        iterator = iter(sentences)
+        batch = []
+        while True:
+            # Only start filling the next batch (transcription runs in a worker
+            # thread) once there is room for it
+            if not batch:
+                await semaphore.acquire()
+            sentence = await asyncio.to_thread(next, iterator, None)
+            if sentence is None:
+                break
+            if self.is_done(*sentence):
+                continue
+            batch.append(sentence)
+            if len(batch) >= batch_size:
+                tasks.append(
+                    asyncio.create_task(self.__process_batch_bounded(semaphore, batch))
+                )
+                batch = []
+        if batch:
+            tasks.append(
+                asyncio.create_task(self.__process_batch_bounded(semaphore, batch))
+            )
+        else:
+            semaphore.release()
+        await asyncio.gather(*tasks)
+
+    def run(self, sentences: Iterable[Tuple[str, str]]):
+        asyncio.run(self.process_sentences(sentences))
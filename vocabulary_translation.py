@@ -1,7 +1,12 @@
+import asyncio
 import os
 import glob
-from typing import List
-from openai import OpenAI
+import json
+from typing import List, Tuple, Union
+from corpus_store import CorpusStore, parse_translated_verbs
+from lemma_index import LemmaIndex
+from llm_cache import LLMCache
+from llm_client import LLMClient, parse_json_object, split_into_batches
 
 
 class VocabularyTranslation:
@@ -18,6 +23,21 @@ class VocabularyTranslation:
             },
         ]
 
+    def __get_batch_translation_prompt(self, texts: List[str]):
+        return [
+            {
+                "role": "system",
+                "content": 'Translate each numbered sentence in the JSON object below to English. Return only a JSON object that maps each sentence number to its translation, for example {"1": "Hello"}. If a sentence has no words use -. Don\'t comment on or annotate the answer in any other way.',
+            },
+            {
+                "role": "user",
+                "content": json.dumps(
+                    {str(number): text for number, text in enumerate(texts, 1)},
+                    ensure_ascii=False,
+                ),
+            },
+        ]
+
     def __get_verb_translation_prompt(self, text: str, vocab: str):
         messages = (
             [
@@ -51,16 +71,37 @@ class VocabularyTranslation:
         model: str = "llama-3.3-70b-instruct",
         nouns_prefix: str = "nouns",
         verbs_prefix: str = "verbs",
+        llm_cache: LLMCache = None,
+        batch_token_budget: int = 1500,
+        corpus_store: CorpusStore = None,
+        lemma_index: LemmaIndex = None,
+        llm_client: LLMClient = None,
     ):
         self.openai_url = openai_url
         self.openai_api_key = openai_api_key
         self.text_path = text_path
         self.model = model
-        self.client = OpenAI(base_url=openai_url, api_key=openai_api_key)
+        self.client = llm_client or LLMClient(openai_url, openai_api_key, llm_cache)
         self.nouns_prefix = nouns_prefix
         self.verbs_prefix = verbs_prefix
+        self.batch_token_budget = batch_token_budget
+        self.corpus_store = corpus_store
+        self.lemma_index = lemma_index
 
     def get_sentences(self, glob_pattern: str = "./**/*].txt"):
+        if self.corpus_store:
+            return [
+                (
+                    os.path.join(
+                        self.text_path, segment["video"], f"{segment['clip_name']}.txt"
+                    ),
+                    segment["transcript"],
+                    segment["nouns"],
+                    segment["verbs"],
+                )
+                for segment in self.corpus_store.get_segments()
+                if segment["verbs"] is not None
+            ]
         texts = []
         files = glob.glob(os.path.join(self.text_path, glob_pattern))
         for file_path in files:
@@ -78,30 +119,139 @@ class VocabularyTranslation:
                         texts.append((file_path, text, nouns, verbs))
         return texts
 
+    def __write_translation(self, translation: str, translation_path: str):
+        if not translation_path:
+            return
+        with open(translation_path, "w") as f:
+            f.write(translation)
+
     def translate_sentence(self, text: str, translated_sentence_path: str) -> str:
         messages = self.__get_message_translation_prompt(text)
-        verbs_completion = self.client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            temperature=0.2,
-            timeout=800,
-        )
-        translation = verbs_completion.choices[0].message.content
-        with open(translated_sentence_path, "w") as f:
-            f.write(translation)
+        translation = self.client.complete(self.model, messages, 0.2)
+        self.__write_translation(translation, translated_sentence_path)
         return translation
 
-    def translate_verbs(
-        self, text: str, vocab: str, translated_verbs_path: str
+    async def translate_sentence_async(
+        self, text: str, translated_sentence_path: str
+    ) -> str:
+        messages = self.__get_message_translation_prompt(text)
+        translation = await self.client.acomplete(self.model, messages, 0.2)
+        self.__write_translation(translation, translated_sentence_path)
+        return translation
+
+    async def translate_sentences_batch_async(
+        self, texts: List[str], translated_sentence_paths: List[str]
     ) -> List[str]:
-        messages = self.__get_verb_translation_prompt(text, vocab)
-        verbs_completion = self.client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            temperature=0.2,
-            timeout=800,
+        translations = [None] * len(texts)
+
+        async def translate_batch(batch: List[int]):
+            messages = self.__get_batch_translation_prompt(
+                [texts[index] for index in batch]
+            )
+            result = (
+                parse_json_object(
+                    await self.client.acomplete(self.model, messages, 0.2)
+                )
+                or {}
+            )
+            for number, index in enumerate(batch, 1):
+                translation = result.get(str(number))
+                if not isinstance(translation, str) or not translation.strip():
+                    # Fall back to a single sentence prompt for anything the
+                    # batched answer didn't cover
+                    translations[index] = await self.translate_sentence_async(
+                        texts[index], translated_sentence_paths[index]
+                    )
+                    continue
+                self.__write_translation(translation, translated_sentence_paths[index])
+                translations[index] = translation
+
+        await asyncio.gather(
+            *(
+                translate_batch(batch)
+                for batch in split_into_batches(texts, self.batch_token_budget)
+            )
         )
-        translation = verbs_completion.choices[0].message.content
-        with open(translated_verbs_path, "w") as f:
-            f.write(translation)
+        return translations
+
+    def __get_verb_lines(self, vocab: Union[str, List[str]]) -> List[str]:
+        if isinstance(vocab, str):
+            vocab = vocab.split("\n")
+        return [line.strip() for line in vocab if ":" in line]
+
+    def __lookup_verbs(self, verbs: List[str]) -> Tuple[List[tuple], List[str]]:
+        # Conjugations already translated in any video are reused from the
+        # lemma index, only the unseen ones are sent to the model
+        known = []
+        unknown = []
+        for line in verbs:
+            verb_es, infinitive_es = [word.strip() for word in line.split(":", 1)]
+            glosses = self.lemma_index.lookup(verb_es, infinitive_es)
+            if glosses:
+                known.append((verb_es, glosses[0], infinitive_es, glosses[1]))
+            else:
+                unknown.append(line)
+        return known, unknown
+
+    def __merge_verb_translation(
+        self, text: str, known: List[tuple], translation: str, video: str
+    ) -> str:
+        verbs = list(known)
+        for verb_es, verb_en, infinitive_es, infinitive_en in parse_translated_verbs(
+            translation
+        ):
+            # Keep one canonical gloss per infinitive across the corpus
+            lemma = self.lemma_index.get_lemma(infinitive_es)
+            if lemma:
+                infinitive_en = lemma["gloss"]
+            verbs.append((verb_es, verb_en, infinitive_es, infinitive_en))
+        for verb in verbs:
+            self.lemma_index.record(*verb, example_es=text, video=video)
+        if not verbs:
+            return "-"
+        return "".join(
+            f"{verb_es}:{verb_en}\n{infinitive_es}:{infinitive_en}\n---\n"
+            for verb_es, verb_en, infinitive_es, infinitive_en in verbs
+        ).rstrip("\n")
+
+    def translate_verbs(
+        self,
+        text: str,
+        vocab: Union[str, List[str]],
+        translated_verbs_path: str,
+        video: str = None,
+    ) -> List[str]:
+        verbs = self.__get_verb_lines(vocab)
+        if not self.lemma_index:
+            messages = self.__get_verb_translation_prompt(text, "\n".join(verbs) or "-")
+            translation = self.client.complete(self.model, messages, 0.2)
+        else:
+            known, unknown = self.__lookup_verbs(verbs)
+            translation = ""
+            if unknown:
+                messages = self.__get_verb_translation_prompt(text, "\n".join(unknown))
+                translation = self.client.complete(self.model, messages, 0.2)
+            translation = self.__merge_verb_translation(text, known, translation, video)
+        self.__write_translation(translation, translated_verbs_path)
+        return translation.split("\n")
+
+    async def translate_verbs_async(
+        self,
+        text: str,
+        vocab: Union[str, List[str]],
+        translated_verbs_path: str,
+        video: str = None,
+    ) -> List[str]:
+        verbs = self.__get_verb_lines(vocab)
+        if not self.lemma_index:
+            messages = self.__get_verb_translation_prompt(text, "\n".join(verbs) or "-")
+            translation = await self.client.acomplete(self.model, messages, 0.2)
+        else:
+            known, unknown = self.__lookup_verbs(verbs)
+            translation = ""
+            if unknown:
+                messages = self.__get_verb_translation_prompt(text, "\n".join(unknown))
+                translation = await self.client.acomplete(self.model, messages, 0.2)
+            translation = self.__merge_verb_translation(text, known, translation, video)
+        self.__write_translation(translation, translated_verbs_path)
         return translation.split("\n")